@@ -0,0 +1 @@
+# makes pyctionary.py importable from the tests
@@ -1,42 +1,1128 @@
 #!/usr/bin/env python3
 
-import sys
-import csv
 import time
+# first line run, for --startup-trace. Modules needed only by some commands
+# (server, saves, audio, sqlite, benchmarks) are imported where they are used
+launched = time.perf_counter()
+
+import io
+import os
+import sys
+import mmap
+import select
+import math
+import struct
 import random
 import curses
 import signal
-import pickle
-import datetime
+import queue
 import argparse
-import subprocess
+import threading
 
 from enum import Enum
+from array import array
+from collections import deque, namedtuple
 from copy import deepcopy as copy
 
 State = Enum('State', 'pick watch getready draw countdown check roll')
+Checkpoint = namedtuple('Checkpoint', 'active_team positions card_data all_play state')
+
+# resolved from the script, not the working directory
+alarm_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'alarm.wav')
 
 class GameTerminated(Exception):
-    def __init__(self, saved=False):
+    def __init__(self, saved=False, error=None):
         self.saved = saved
+        # why the game could not be saved
+        self.error = error
 
 class ScreenTooSmall(GameTerminated):
-    pass
+    def __init__(self, saved=False, lines=32, cols=104, error=None):
+        self.saved = saved
+        self.error = error
+        self.lines = lines
+        self.cols = cols
+
+class Effect:
+    def __init__(self, duration, on_tick=None, interval=None, on_done=None):
+        self.duration = duration
+        self.on_tick = on_tick
+        self.interval = interval
+        self.on_done = on_done
+        self.deadline = None
+        self.next_tick = None
+
+class Effects:
+    # timed effects (animations, banners, pauses) played one after the other
+    # while the main loop keeps serving input
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, duration, on_tick=None, interval=None, on_done=None):
+        self.queue.append(Effect(duration, on_tick, interval, on_done))
+
+    def run(self):
+        now = self.clock()
+        while self.queue:
+            effect = self.queue[0]
+            if effect.deadline is None:
+                effect.deadline = now + effect.duration
+                effect.next_tick = now
+            if effect.on_tick and effect.next_tick <= now < effect.deadline:
+                effect.on_tick()
+                effect.next_tick = now + effect.interval
+            if now < effect.deadline:
+                break
+            self.queue.popleft()
+            if effect.on_done:
+                effect.on_done()
+
+    def skip(self):
+        while self.queue:
+            effect = self.queue.popleft()
+            # make sure animations leave a result behind
+            if effect.deadline is None and effect.on_tick:
+                effect.on_tick()
+            if effect.on_done:
+                effect.on_done()
+
+    def next_wakeup(self):
+        # seconds until the running effect needs to be served again
+        effect = self.queue[0]
+        wakeup = effect.deadline
+        if effect.on_tick:
+            wakeup = min(wakeup, effect.next_tick)
+        return max(0, wakeup - self.clock())
+
+class Timer:
+    # countdown on a monotonic clock: time is consumed only while running,
+    # and read from the start of the run rather than accumulated, so that it
+    # neither drifts nor jumps with the wall clock
+    def __init__(self, duration, clock=time.monotonic):
+        self.duration = duration
+        self.clock = clock
+        # seconds left when the current run started, None when paused
+        self.left = duration
+        self.started = None
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def start(self, left=None):
+        self.left = self.duration if left is None else left
+        self.started = self.clock()
+
+    def pause(self):
+        if self.running:
+            self.left = self.remaining()
+            self.started = None
+
+    def resume(self):
+        if not self.running:
+            self.started = self.clock()
+
+    def remaining(self):
+        if not self.running:
+            return self.left
+        return max(0, self.left - (self.clock() - self.started))
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def elapsed(self):
+        # whole seconds gone as shown, the second in progress not counted
+        return self.duration - math.ceil(self.remaining())
+
+    def next_wakeup(self):
+        # seconds until the next shown second, None when paused
+        if not self.running:
+            return None
+        remaining = self.remaining()
+        return remaining - (math.ceil(remaining) - 1) if remaining > 0 else 0
+
+class Surface:
+    # shadow copy of a curses window, only the cells that changed since the
+    # previous frame are written out
+    blank = (u' ', 0)
+
+    def __init__(self, win):
+        self.win = win
+        self.cells = {}
+        self.shown = {}
+        self.dirty = set()
+        self.background = None
+
+    def __getattr__(self, name):
+        # everything else (box, getch, timeout, ...) goes to the window
+        return getattr(self.win, name)
+
+    def bkgd(self, ch, attr=0):
+        if self.background != (ch, attr):
+            self.background = (ch, attr)
+            self.win.bkgd(ch, attr)
+
+    def addstr(self, y, x, text, attr=0):
+        for i, ch in enumerate(text):
+            self.cells[y, x+i] = (ch, attr)
+            self.dirty.add((y, x+i))
+
+    def erase(self):
+        self.dirty.update(self.cells)
+        self.cells = {}
+
+    def reset(self):
+        # forget what the window shows, after it was moved or the screen
+        # cleared everything is written again
+        self.win.erase()
+        self.cells = {}
+        self.shown = {}
+        self.dirty = set()
+        self.background = None
+
+    def noutrefresh(self):
+        # write the changed cells in runs sharing the same row and attribute,
+        # returns the runs written as (y, x, text) in screen coordinates
+        runs = []
+        run = None
+        for y, x in sorted(self.dirty):
+            cell = self.cells.get((y, x), self.blank)
+            if self.shown.get((y, x), self.blank) == cell:
+                continue
+            if run and run[0] == y and run[1] + len(run[2]) == x and run[3] == cell[1]:
+                run[2].append(cell[0])
+            else:
+                if run:
+                    runs.append(self._write(*run))
+                run = [y, x, [cell[0]], cell[1]]
+            if cell == self.blank:
+                del self.shown[y, x]
+            else:
+                self.shown[y, x] = cell
+        if run:
+            runs.append(self._write(*run))
+        self.dirty.clear()
+        self.win.noutrefresh()
+        return runs
+
+    def _write(self, y, x, chars, attr):
+        text = u''.join(chars)
+        self.win.addstr(y, x, text, attr)
+        top, left = self.win.getbegyx()
+        return top+y, left+x, text
+
+class Traffic:
+    # bytes sent to the terminal per frame and per state, estimated from the
+    # terminfo sequences needed to move to and paint each run of cells
+    def __init__(self, max_fps):
+        self.max_fps = max_fps
+        self.frames = 0
+        self.bytes = 0
+        self.max_bytes = 0
+        self.states = {}
+        self.cup = None
+        self.sgr = 0
+
+    def cost(self, runs):
+        if self.cup is None:
+            self.cup = curses.tigetstr('cup') or b''
+            self.sgr = sum(len(curses.tparm(curses.tigetstr(cap) or b'', 0))
+                for cap in ['sgr0', 'setaf', 'setab'])
+        return sum(len(curses.tparm(self.cup, y, x)) + self.sgr + len(text.encode('utf-8'))
+            for y, x, text in runs)
+
+    def add_frame(self, state, runs):
+        size = self.cost(runs)
+        self.frames += 1
+        self.bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+        frames, total = self.states.get(state, (0, 0))
+        self.states[state] = (frames + 1, total + size)
+
+    def summary(self):
+        lines = [u'Frames: {}, bytes: {} ({:.1f} per frame, max {}, cap {} fps)'.format(
+            self.frames, self.bytes, self.bytes / max(self.frames, 1), self.max_bytes, self.max_fps)]
+        for state, (frames, total) in sorted(self.states.items()):
+            lines.append(u'  {:<10s} {:6d} frames {:9d} bytes ({:.1f} per frame)'.format(
+                state, frames, total, total / frames))
+        return u'\n'.join(lines) + u'\n'
+
+class NullBackend:
+    # plays nothing, records when each sound would have started
+    def __init__(self):
+        self.played = []
+        self.event = threading.Event()
+
+    def play(self, sound):
+        self.played.append(time.perf_counter())
+        self.event.set()
+
+    def close(self):
+        pass
+
+class AplayBackend:
+    # an aplay process per sound, started by the alarm worker when the sound
+    # is played: aplay opens the sound card as soon as it starts, so none is
+    # kept waiting, which would hold the device for the whole game
+    command = ['aplay', '-q', '-t', 'wav', '-']
+
+    def __init__(self):
+        self.playing = []
+        self.error = None
+
+    def play(self, sound):
+        import subprocess
+        process = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.playing.append(process)
+        try:
+            process.stdin.write(sound.wav)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reap()
+
+    def _reap(self):
+        for process in [process for process in self.playing if process.poll() is not None]:
+            self.playing.remove(process)
+            message = process.stderr.read().decode('utf-8', 'replace').strip()
+            process.stderr.close()
+            if process.returncode:
+                raise OSError(message or u'aplay exited with status {}'.format(process.returncode))
+
+    def close(self):
+        # a sound being played is left to end
+        self._reap()
+
+Sound = namedtuple('Sound', 'params frames wav')
+
+class Alarm:
+    # alarm sound decoded once by a worker thread, which then hands it to the
+    # backend: neither startup nor a timeout wait for the sound
+    def __init__(self, path, backend):
+        self.path = path
+        self.backend = backend
+        self.error = None
+        self.sound = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def load(path):
+        import wave
+        with wave.open(path, 'rb') as f:
+            params = f.getparams()
+            frames = f.readframes(params.nframes)
+        # plain pcm wav, whatever the layout of the original file
+        data = io.BytesIO()
+        with wave.open(data, 'wb') as f:
+            f.setparams(params)
+            f.writeframes(frames)
+        return Sound(params, frames, data.getvalue())
+
+    def play(self):
+        if self.thread:
+            self.queue.put(True)
+
+    def _run(self):
+        import wave
+        try:
+            self.sound = self.load(self.path)
+        except (OSError, EOFError, wave.Error) as e:
+            self.error = u'unable to load {}: {}'.format(self.path, e)
+            return
+        while self.queue.get():
+            self._call(self.backend.play, self.sound)
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+        except OSError as e:
+            self.error = u'{}: {}'.format(e.filename, e.strerror) if e.filename else e.strerror or str(e)
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._call(self.backend.close)
+
+class StartupTrace:
+    # time spent in each phase of the startup, from the first line run to the
+    # first frame
+    def __init__(self, start=launched):
+        self.last = start
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def summary(self):
+        lines = []
+        total = 0
+        for name, seconds in self.phases:
+            total += seconds
+            lines.append(u'{:<16s} {:8.1f} ms {:8.1f} ms\n'.format(name, seconds * 1e3, total * 1e3))
+        return u''.join(lines)
+
+class Histogram:
+    # durations counted in buckets of powers of two microseconds
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile, in seconds
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= self.count * p / 100:
+                return (1 << bucket) / 1e6
+        return 0
+
+    def summary(self, name):
+        lines = [u'{:<24s} {:7d} calls, mean {:9.3f} ms, p50 < {:9.3f} ms, p99 < {:9.3f} ms, max {:9.3f} ms'.format(
+            name, self.count, self.total / self.count * 1000, self.percentile(50) * 1000,
+            self.percentile(99) * 1000, self.max * 1000)]
+        most = max(self.buckets.values())
+        for bucket in sorted(self.buckets):
+            lines.append(u'    < {:>9.3f} ms {:7d} {}'.format((1 << bucket) / 1000,
+                self.buckets[bucket], u'#' * (40 * self.buckets[bucket] // most)))
+        return u'\n'.join(lines)
+
+class Profiler:
+    # latency histograms of a game (ticks per state, input to frame, drawing
+    # calls, saves and idle time) and a cProfile of its loop. Game methods are
+    # wrapped on the instance only when profiling, so that it costs nothing
+    # otherwise
+    def __init__(self, path):
+        import cProfile
+        self.path = path
+        self.histograms = {}
+        self.profile = cProfile.Profile()
+        self.commit_time = 0
+        self.key_time = None
+        self.tick_start = None
+        self.tick_state = None
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    def timed(self, name, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+        return wrapper
+
+    def attach(self, game):
+        for name in dir(game):
+            if name.startswith(('draw_', 'update_')) or name in ['render', 'render_card', 'blank_card']:
+                setattr(game, name, self.timed(u'call ' + name, getattr(game, name)))
+        game.save_game = self.timed(u'save snapshot', game.save_game)
+        game.journal_event = self.timed(u'save event', game.journal_event)
+        game.journal._replace = self.timed(u'write snapshot', game.journal._replace)
+        game.commit = self._commit(game, game.commit)
+        game.wait_key = self._wait_key(game, game.wait_key)
+
+    def _commit(self, game, commit):
+        def wrapper(force=False):
+            start = time.perf_counter()
+            commit(force)
+            end = time.perf_counter()
+            self.commit_time += end - start
+            self.record(u'call commit', end - start)
+            # a frame held back by the frame cap is not shown yet
+            if self.key_time is not None and not game.frame_pending:
+                self.record(u'input to frame', end - self.key_time)
+                self.key_time = None
+        return wrapper
+
+    def _wait_key(self, game, wait_key):
+        def wrapper(timeout):
+            start = time.perf_counter()
+            if self.tick_start is not None:
+                self.record(u'tick ' + self.tick_state, start - self.tick_start)
+            committed = self.commit_time
+            key = wait_key(timeout)
+            end = time.perf_counter()
+            self.record(u'idle', end - start - (self.commit_time - committed))
+            self.tick_start = end
+            self.tick_state = game.engine.state.name
+            if key != -1:
+                self.key_time = end
+            return key
+        return wrapper
+
+    def run(self, fn, *args):
+        self.profile.enable()
+        try:
+            return fn(*args)
+        finally:
+            self.profile.disable()
+
+    def dump(self):
+        # write the cProfile stats (readable with pstats) and return the
+        # histograms
+        try:
+            self.profile.dump_stats(self.path)
+        except OSError as e:
+            sys.stderr.write(u'Unable to write the profile {}: {}\n'.format(self.path, e.strerror))
+        return u''.join(self.histograms[name].summary(name) + u'\n'
+            for name in sorted(self.histograms))
+
+class CardFile:
+    # cards read from a file, saved as the path of the file only
+    def __getstate__(self):
+        # saves may be restored from another directory
+        return {'path': os.path.abspath(self.path)}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+class CardStore(CardFile):
+    # card file mapped in memory, rows are parsed only when drawn through an
+    # index of row offsets cached next to the file
+    index_magic = b'PYCI'
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        stat = os.fstat(self.file.fileno())
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.offsets = self._load_index(stat)
+        self.categories = self._parse(0) if len(self.offsets) > 1 else []
+
+    def __len__(self):
+        # offsets hold the start of every row (header included) and the end
+        # of the file
+        return max(len(self.offsets) - 2, 0)
+
+    def __getitem__(self, idx):
+        return self._parse(idx + 1)
+
+    def _parse(self, row):
+        import csv
+        text = self.data[self.offsets[row]:self.offsets[row+1]].decode('utf-8')
+        return next(csv.reader(io.StringIO(text)))
+
+    def _load_index(self, stat):
+        # the cache is valid as long as the file keeps its mtime and size
+        key = struct.pack('<4sqQ', self.index_magic, stat.st_mtime_ns, stat.st_size)
+        index_path = self.path + '.idx'
+        try:
+            with open(index_path, 'rb') as f:
+                if f.read(len(key)) == key:
+                    offsets = array('Q')
+                    offsets.frombytes(f.read())
+                    return offsets
+        except OSError:
+            pass
+        offsets = self._build_index()
+        try:
+            with open(index_path + '.tmp', 'wb') as f:
+                f.write(key)
+                offsets.tofile(f)
+            os.replace(index_path + '.tmp', index_path)
+        except OSError:
+            # read-only location, keep the index in memory only
+            pass
+        return offsets
+
+    def _build_index(self):
+        offsets = array('Q')
+        pos = 0
+        quoted = False
+        self.file.seek(0)
+        for line in self.file:
+            # a line starts a new row unless a quoted field spans it, blank
+            # lines are skipped
+            if not quoted and line.strip():
+                offsets.append(pos)
+            quoted ^= line.count(b'"') % 2 == 1
+            pos += len(line)
+        offsets.append(pos)
+        return offsets
+
+class CompiledDeck(CardFile):
+    # binary deck written by compile-deck: a header, the offsets of every
+    # string in a pool of interned utf-8 strings, one fixed-width table of
+    # string ids per category and the pool itself, all read through mmap
+    magic = b'PYCD'
+    version = 1
+    header = struct.Struct('<4sHHIII')
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_categories, self.num_rows, num_strings, pool_size = \
+            self.header.unpack_from(self.data)
+        if magic != self.magic or version != self.version:
+            raise ValueError(u'Unsupported deck file')
+        pos = self.header.size
+        self.offsets = self._table(pos, num_strings + 1)
+        pos += (num_strings + 1) * 4
+        self.columns = []
+        for _ in range(num_categories):
+            self.columns.append(self._table(pos, self.num_rows))
+            pos += self.num_rows * 4
+        self.pool = memoryview(self.data)[pos:pos+pool_size]
+        # the category names are the first strings of the pool
+        self.categories = [self._string(i) for i in range(num_categories)]
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, idx):
+        return [self._string(column[idx]) for column in self.columns]
+
+    def _table(self, pos, length):
+        view = memoryview(self.data)[pos:pos+length*4]
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        table = array('I', view)
+        table.byteswap()
+        return table
+
+    def _string(self, idx):
+        return str(self.pool[self.offsets[idx]:self.offsets[idx+1]], 'utf-8')
+
+    @classmethod
+    def compile(cls, cards, path):
+        strings = {}
+        pool = bytearray()
+        offsets = array('I', [0])
+
+        def intern(text):
+            if text not in strings:
+                strings[text] = len(strings)
+                pool.extend(text.encode('utf-8'))
+                offsets.append(len(pool))
+            return strings[text]
+
+        for category in cards.categories:
+            intern(category)
+        columns = [array('I') for _ in cards.categories]
+        for i in range(len(cards)):
+            card = cards[i]
+            if len(card) != len(columns):
+                raise ValueError(u'Row {} has {} fields, {} expected'.format(i+2, len(card), len(columns)))
+            for column, text in zip(columns, card):
+                column.append(intern(text))
+
+        if sys.byteorder != 'little':
+            for table in [offsets] + columns:
+                table.byteswap()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(cls.header.pack(cls.magic, cls.version, len(columns), len(cards),
+                len(strings), len(pool)))
+            offsets.tofile(f)
+            for column in columns:
+                column.tofile(f)
+            f.write(pool)
+        os.replace(path + '.tmp', path)
+
+class Deck:
+    # cards are shuffled once (Fisher-Yates) and drawn from the end of the
+    # permutation, drawn cards are discarded and the discard pile is
+    # reshuffled when the deck runs out
+    def __init__(self, cards, seed=None, background=False):
+        self.cards = cards
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.shuffles = 0
+        self.pos = 0
+        self.loading = None
+        if background:
+            # shuffled by a thread, the first draw waits for it
+            self.loading = threading.Thread(target=self._build, daemon=True)
+            self.loading.start()
+        else:
+            self._build()
+
+    def wait(self):
+        if self.loading:
+            self.loading.join()
+            self.loading = None
+
+    def __len__(self):
+        self.wait()
+        return len(self.order) - self.pos
+
+    def _build(self):
+        # the permutation is rebuilt from the seed, so that only the seed,
+        # the number of shuffles and the position need to be saved
+        self.random = random.Random(self.seed)
+        self.order = array('L', range(len(self.cards)))
+        for _ in range(self.shuffles + 1):
+            self.random.shuffle(self.order)
+
+    def seek(self, shuffles, pos):
+        self.wait()
+        if shuffles != self.shuffles:
+            self.shuffles = shuffles
+            self._build()
+        self.pos = pos
+
+    def reshuffle(self):
+        self.wait()
+        self.random.shuffle(self.order)
+        self.shuffles += 1
+        self.pos = 0
+
+    def peek(self):
+        if not len(self):
+            self.reshuffle()
+        return self.cards[self.order[-1-self.pos]]
+
+    def draw(self):
+        card = self.peek()
+        self.pos += 1
+        return card
+
+    def __getstate__(self):
+        return {
+            'cards': self.cards,
+            'seed': self.seed,
+            'shuffles': self.shuffles,
+            'pos': self.pos}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.loading = None
+        self._build()
+
+def card_hash(card):
+    # stable across sessions and card files: a 64 bit hash of the words
+    import hashlib
+    digest = hashlib.blake2b(u'\x1f'.join(card).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+class CardHistory:
+    # cards played across sessions, in a SQLite database keyed by card hash:
+    # whether a card was played recently is a single primary key lookup,
+    # whatever the size of the deck and of the history
+    schema = '''
+        CREATE TABLE IF NOT EXISTS played (
+            hash INTEGER PRIMARY KEY,
+            last_played REAL NOT NULL,
+            count INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS outcomes (
+            hash INTEGER NOT NULL,
+            category INTEGER NOT NULL,
+            successes INTEGER NOT NULL,
+            failures INTEGER NOT NULL,
+            PRIMARY KEY (hash, category)) WITHOUT ROWID'''
+
+    def __init__(self, path, days=30, clock=time.time):
+        import sqlite3
+        self.days = days
+        self.clock = clock
+        self.db = sqlite3.connect(path)
+        # commits without a sync each, the database stays consistent
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.schema)
+
+    def recent(self, card):
+        row = self.db.execute('SELECT last_played FROM played WHERE hash = ?', (card_hash(card),)).fetchone()
+        return row is not None and row[0] > self.clock() - self.days * 86400
+
+    def record(self, card):
+        with self.db:
+            self.db.execute('''
+                INSERT INTO played (hash, last_played, count) VALUES (?, ?, 1)
+                ON CONFLICT (hash) DO UPDATE SET last_played = excluded.last_played, count = count + 1''',
+                (card_hash(card), self.clock()))
+
+    def record_outcome(self, card, category, success):
+        # returns the successes and failures of the card in the category
+        key = (card_hash(card), category)
+        with self.db:
+            self.db.execute('''
+                INSERT INTO outcomes (hash, category, successes, failures) VALUES (?, ?, ?, ?)
+                ON CONFLICT (hash, category) DO UPDATE SET
+                    successes = successes + excluded.successes, failures = failures + excluded.failures''',
+                key + (int(success), int(not success)))
+            return self.db.execute('SELECT successes, failures FROM outcomes WHERE hash = ? AND category = ?',
+                key).fetchone()
+
+    def outcomes(self):
+        # hash -> {category: (successes, failures)}
+        outcomes = {}
+        for key, category, successes, failures in self.db.execute('SELECT * FROM outcomes'):
+            outcomes.setdefault(key, {})[category] = (successes, failures)
+        return outcomes
+
+    def close(self):
+        self.db.close()
+
+class AliasTable:
+    # Walker's alias method (Vose's variant): O(n) to build, O(1) to sample
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+    def sample(self, rand):
+        i = rand.randrange(len(self.prob))
+        return i if rand.random() < self.prob[i] else self.alias[i]
+
+class DifficultySampler:
+    # draws cards weighted toward a target difficulty, the estimated odds of
+    # failing a card in a category (Beta(1, 1) prior, so 0.5 when unknown).
+    # Per category, cards are grouped in buckets of similar difficulty: an
+    # alias table picks the bucket and the card is picked uniformly in it. An
+    # outcome moves a single card between buckets and only the alias table of
+    # the buckets is rebuilt, so both draws and updates are O(1)
+    buckets = 20
+    spread = 0.15
+
+    def __init__(self, cards, categories, outcomes, target, rand):
+        self.target = target
+        self.random = rand
+        size = len(cards)
+        default = self._bucket(0.5)
+        # per category: cards of every bucket, bucket of every card and its
+        # position in the bucket
+        self.members = []
+        self.bucket = []
+        self.slot = []
+        for _ in range(categories):
+            members = [array('L') for _ in range(self.buckets)]
+            members[default] = array('L', range(size))
+            self.members.append(members)
+            self.bucket.append(array('B', [default]) * size)
+            self.slot.append(array('L', range(size)))
+        self.tables = [None] * categories
+        if outcomes:
+            # cards are known by hash only, they all need hashing once
+            for index, card in enumerate(cards):
+                for category, (successes, failures) in outcomes.get(card_hash(card), {}).items():
+                    if category < categories:
+                        self._move(category, index, successes, failures)
+        for category in range(categories):
+            self._build(category)
+
+    def _bucket(self, difficulty):
+        return min(int(difficulty * self.buckets), self.buckets - 1)
+
+    def _build(self, category):
+        weights = []
+        for bucket, members in enumerate(self.members[category]):
+            center = (bucket + 0.5) / self.buckets
+            weights.append(len(members) * math.exp(-((center - self.target) / self.spread) ** 2 / 2))
+        self.tables[category] = AliasTable(weights)
+
+    def _move(self, category, index, successes, failures):
+        bucket = self._bucket((failures + 1) / (successes + failures + 2))
+        old = self.bucket[category][index]
+        if bucket == old:
+            return False
+        members = self.members[category][old]
+        slot = self.slot[category][index]
+        members[slot] = members[-1]
+        self.slot[category][members[slot]] = slot
+        members.pop()
+        members = self.members[category][bucket]
+        self.slot[category][index] = len(members)
+        members.append(index)
+        self.bucket[category][index] = bucket
+        return True
+
+    def draw(self, category):
+        members = self.members[category][self.tables[category].sample(self.random)]
+        return members[self.random.randrange(len(members))]
+
+    def update(self, index, category, successes, failures):
+        if self._move(category, index, successes, failures):
+            self._build(category)
+
+class Journal:
+    # append-only game log: the file starts with a snapshot of the whole game
+    # followed by one small record per transition, holding only the fields
+    # that changed. Every snapshot_every events the file is replaced by a new
+    # snapshot, so that restoring never replays more than that.
+    # Records are pickled by the caller and written by a background thread,
+    # which coalesces bursts into a single write and fsync at most once every
+    # interval seconds; snapshots go to a temporary file which is synced and
+    # renamed over the journal, so a killed process always leaves a valid one
+    snapshot_every = 100
+
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self.events = 0
+        self.queue = queue.Queue()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.last_save = None
+        # why the last write failed, until a snapshot is written
+        self.error = None
+
+    def snapshot(self, game):
+        self._put(True, ('snapshot', game))
+        self.events = 0
+
+    def event(self, changes):
+        self._put(False, ('event', changes))
+        self.events += 1
+
+    def _put(self, snapshot, record):
+        import pickle
+        if self.thread is None:
+            self.wakeup.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put((snapshot, pickle.dumps(record, pickle.HIGHEST_PROTOCOL)))
+
+    def since_save(self):
+        # seconds since the last durable write, None if nothing was written
+        if self.last_save is None:
+            return None
+        return time.monotonic() - self.last_save
+
+    def close(self):
+        # wait for the pending records to be written
+        if self.thread:
+            self.queue.put(None)
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _run(self):
+        f = None
+        while True:
+            records = [self.queue.get()]
+            if records[0] is not None and self.last_save is not None:
+                self.wakeup.wait(self.last_save + self.interval - time.monotonic())
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            records = [record for record in records if record is not None]
+            # a snapshot supersedes everything queued before it
+            snapshots = [i for i, record in enumerate(records) if record[0]]
+            if snapshots:
+                records = records[snapshots[-1]:]
+            elif f is None:
+                # after a failed write, events could only be appended to a
+                # torn record: they wait for the next snapshot
+                records = []
+            data = b''.join(record[1] for record in records)
+            try:
+                if snapshots:
+                    if f:
+                        f.close()
+                        f = None
+                    self._replace(data)
+                    f = open(self.path, 'ab')
+                    self.error = None
+                elif data:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if data:
+                    self.last_save = time.monotonic()
+            except Exception as e:
+                # the thread keeps serving the game, which is told to write
+                # a snapshot through the error
+                self.error = getattr(e, 'strerror', None) or str(e)
+                if f:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                    f = None
+            if stop:
+                if f:
+                    f.close()
+                return
+
+    def _replace(self, data):
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+        # make the rename itself durable
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # what saves are made of: anything else in a file is refused rather than
+    # imported, saves may come from anywhere
+    game_classes = ['State', 'Checkpoint', 'Team', 'History', 'Deck', 'CardStore', 'CompiledDeck']
+    safe_classes = {
+        'builtins': ['set', 'frozenset', 'bytearray', 'complex', 'range', 'slice'],
+        'collections': ['deque', 'OrderedDict']}
+
+    @staticmethod
+    def load(path, replace=None):
+        # replace maps names of classes of the game to the classes to load
+        # instead
+        import pickle
+        replace = replace or {}
+
+        def enum_member(cls, name):
+            # enums are pickled by name with getattr since Python 3.12
+            if cls is not State:
+                raise pickle.UnpicklingError(u'Unexpected getattr on {!r}'.format(cls))
+            return cls[name]
+
+        class Unpickler(pickle.Unpickler):
+            # classes are saved as those of __main__, which is another module
+            # when the script is imported
+            def find_class(self, module, name):
+                if module in ['__main__', __name__] and name in Journal.game_classes:
+                    return replace.get(name) or getattr(sys.modules[__name__], name)
+                if (module, name) == ('builtins', 'getattr'):
+                    return enum_member
+                if name in Journal.safe_classes.get(module, []):
+                    return super().find_class(module, name)
+                raise pickle.UnpicklingError(u'Unexpected {}.{} in a save'.format(module, name))
+
+        with open(path, 'rb') as f:
+            # every record is pickled on its own, with its own memo
+            record = Unpickler(f).load()
+            if isinstance(record, dict):
+                # whole-game pickle written by older versions
+                return record
+            if record[0] != 'snapshot':
+                raise pickle.UnpicklingError(u'Journal does not start with a snapshot')
+            game = record[1]
+            while True:
+                try:
+                    record = Unpickler(f).load()
+                except (EOFError, pickle.UnpicklingError):
+                    # end of the journal, or a record cut short by a crash
+                    break
+                for name, value in record[1].items():
+                    if name == 'history':
+                        for op in value:
+                            getattr(game['history'], op[0])(*op[1:])
+                    elif name == 'deck':
+                        game['deck'].seek(*value)
+                    else:
+                        game[name] = value
+        return game
+
+class History:
+    # undo/redo history of the game checkpoints: only the latest checkpoint is
+    # kept whole, the previous ones are stored as the fields that differ from
+    # the checkpoint that follows them (for positions, the teams that moved),
+    # up to depth of them
+    def __init__(self, depth):
+        self.current = None
+        self.undo = deque(maxlen=depth)
+        self.redo = []
+        # operations not logged to the journal yet
+        self.ops = []
+
+    def __len__(self):
+        return 0 if self.current is None else len(self.undo) + 1
+
+    def push(self, checkpoint):
+        if self.current is not None:
+            self.undo.append(self._delta(checkpoint, self.current))
+        self.current = checkpoint
+        self.redo = []
+        self.ops.append(('push', checkpoint))
+
+    def back(self):
+        previous = self._apply(self.current, self.undo.pop())
+        self.redo.append(self._delta(previous, self.current))
+        self.current = previous
+        self.ops.append(('back',))
+
+    def forward(self):
+        following = self._apply(self.current, self.redo.pop())
+        self.undo.append(self._delta(following, self.current))
+        self.current = following
+        self.ops.append(('forward',))
+
+    @staticmethod
+    def _delta(checkpoint, target):
+        # fields to change in checkpoint to get target
+        delta = {}
+        for name, value, new_value in zip(Checkpoint._fields, checkpoint, target):
+            if name == 'positions':
+                moves = [(team, new) for team, (old, new) in enumerate(zip(value, new_value)) if old != new]
+                if moves:
+                    delta['positions'] = moves
+            elif value != new_value:
+                delta[name] = new_value
+        return delta
+
+    @staticmethod
+    def _apply(checkpoint, delta):
+        if 'positions' in delta:
+            positions = list(checkpoint.positions)
+            for team, position in delta['positions']:
+                positions[team] = position
+            delta = dict(delta, positions=tuple(positions))
+        return checkpoint._replace(**delta)
 
 class Team:
     def __init__(self, team_id, color=None):
         self.id = team_id
         self.color = color
 
-class Game:
+class Engine:
+    # the game rules as a state machine that knows nothing about terminals:
+    # feed() takes a key (-1 when woken up by a timer), runs the automaton
+    # until it needs input or time again and returns what to render, as a
+    # set of intents ('board', 'card', 'footer' and 'alarm')
     board_str = 'ybMgRYbmG*RYbmGyRB*mGyRMbgR*YBmgRbYMg*RyBMgyBmR'
-    category_colors = []
-    team_colors = []
-    interrupted = False
+    team_names = [u'blue', u'magenta', u'green', u'yellow']
+    category_names = [u'yellow', u'blue', u'magenta', u'green', u'red']
 
     # all possible game strings
-    text_header = u'Pyctionary, a word game for geeks. ESC to quit, \'<\' to undo'
     text_countdown = u'Time left (Ctrl-C to interrupt): '
+    text_paused = u'Paused (P to resume): '
     text_timeout = u'Time is up!'
     text_dice = u'Roll the dice (1-6 or 0 to randomly advance): '
     text_hide_card = u'Press ENTER to hide the card'
@@ -45,38 +1131,555 @@ class Game:
     text_success_or_fail = u'(S)uccess or (F)ail? '
     text_pick_card = u'Press ENTER to pick a card'
     text_finish_line = u'Not going forward, finish line already reached'
-    text_save_game = u'Save game? (Y/N) '
-    chr_active_marker = u'▶'
-    text_all_play_marker = u'◀▶'
+    text_winning_team = u'Winning team '
+    text_no_team = u', (N)one: '
     fmt_moving = u'Moving forward of {} positions'
 
-    # sand timer, in seconds
-    timeout = 60
+    # draws of the difficulty sampler to find a card not played recently
+    sampler_tries = 10
 
-    def __init__(self, stdscr, categories, cards, num_teams, restore_file):
-        self.stdscr = stdscr
+    def __init__(self, categories, deck, num_teams, undo_depth=100, clock=time.monotonic, seed=None, timeout=60,
+            card_history=None, difficulty=None):
         self.categories = categories
-        self.cards = cards
+        self.deck = deck
+        self.card_history = card_history
+        self.skipped = 0
         self.num_teams = num_teams
-        self.restore_file = restore_file
-
-        self.states = []
-
-        self.teams = []
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.history = History(undo_depth)
+        self.effects = Effects(clock)
+        # draws weighted by difficulty, from the outcomes in the card history
+        self.sampler = None
+        if card_history and difficulty is not None:
+            self.sampler = DifficultySampler(deck.cards, len(categories), card_history.outcomes(),
+                difficulty, self.random)
+        self.card_index = None
+        # rows of the card file not matching its header, skipped when drawn
+        self.invalid_cards = set()
+        # sand timer, in seconds
+        self.timer = Timer(timeout, clock)
+
+        self.teams = [Team(i, color=self.team_names[i]) for i in range(num_teams)]
         # randomize active team on startup
-        self.active_team = random.randint(0, self.num_teams-1)
-        self.positions = []
+        self.active_team = self.random.randint(0, self.num_teams-1)
+        self.positions = [0] * num_teams
         self.card_data = []
-        self.time_start = 0
         self.all_play = False
         self.state = State.pick
+        self.next_state = self.state
         self.cell = self.board_str[0]
+        self.dice = 1
+        self.interrupted = False
+
+        # interface: footer message, the answer typed after it, seconds
+        # elapsed while counting down and whether the card is shown
+        self.message = u''
+        self.answer = u''
+        self.elapsed = None
+        self.card_visible = False
+        self.intents = set()
+
+    def start(self):
+        # enter the current state, either the first one or a restored one
+        if self.state == State.countdown:
+            self.timer.resume()
+        self._enter()
+        self.step(-1)
+        self.effects.run()
+        self.intents.update(['board', 'card', 'footer'])
+        return self._advance()
+
+    def feed(self, key=-1):
+        if self.effects:
+            # any key skips the running effects
+            if key != -1:
+                self.effects.skip()
+            self.effects.run()
+        else:
+            if key == ord('<'):
+                self.undo()
+                key = -1
+            elif key == ord('>'):
+                self.redo()
+                key = -1
+            self.step(key)
+            self.effects.run()
+        return self._advance()
+
+    def _advance(self):
+        # internal transitions happen right away, unless an effect is playing
+        while not self.effects and self.next_state != self.state:
+            self.state = self.next_state
+            self._enter()
+            self.step(-1)
+            self.effects.run()
+        intents = self.intents
+        self.intents = set()
+        return intents
+
+    def _enter(self):
+        if self.state in [State.pick, State.check, State.roll] \
+        and self.history.current != self.get_state():
+            self.history.push(self.get_state())
+
+    def next_wakeup(self):
+        # seconds until the engine must be fed again, None to wait for input
+        if self.effects:
+            return self.effects.next_wakeup()
+        if self.state == State.countdown:
+            return self.timer.next_wakeup()
+        return None
+
+    @property
+    def time_left(self):
+        return self.timer.remaining()
+
+    def interrupt(self):
+        self.interrupted = True
+
+    def pause(self):
+        self.timer.pause()
+        self.intents.add('footer')
+
+    def resume(self):
+        if self.state == State.countdown:
+            self.timer.resume()
+            self.intents.add('footer')
+
+    def undo(self):
+        if self.history:
+            if self.state in [State.pick, State.check, State.roll] and self.history.undo:
+                self.history.back()
+            self.load_state(*self.history.current)
+            self.intents.update(['board', 'card', 'footer'])
+
+    def redo(self):
+        if self.history.redo:
+            self.history.forward()
+            self.load_state(*self.history.current)
+            self.intents.update(['board', 'card', 'footer'])
+
+    def _say(self, message, answer=u''):
+        self.message = message
+        self.answer = answer
+        self.elapsed = None
+        self.intents.add('footer')
+
+    def _show_card(self, visible):
+        self.card_visible = visible
+        self.intents.add('card')
+
+    def step(self, key):
+        # game automaton
+        if self.state == State.pick:
+            self.cell = self.board_str[self.positions[self.active_team]]
+            self._show_card(False)
+            self._say(self.text_pick_card)
+            if key in [curses.KEY_ENTER, 10, 13]:
+                self.pick_card()
+                self.next_state = State.watch
+
+        elif self.state == State.watch:
+            self._show_card(True)
+            self._say(self.text_hide_card)
+            if key in [curses.KEY_ENTER, 10, 13]:
+                self.next_state = State.getready
+
+        elif self.state == State.getready:
+            self._show_card(False)
+            self._say(self.text_getready)
+            if key in [curses.KEY_ENTER, 10, 13]:
+                self.next_state = State.draw
+
+        elif self.state == State.draw:
+            self.timer.start()
+            self.interrupted = False
+            self.next_state = State.countdown
+
+        elif self.state == State.countdown:
+            if key in [ord('P'), ord('p')]:
+                if self.timer.running:
+                    self.timer.pause()
+                else:
+                    self.timer.resume()
+            elapsed = self.timer.elapsed()
+            message = self.text_countdown if self.timer.running else self.text_paused
+            if self.timer.expired():
+                self.timer.pause()
+                self.next_state = State.check
+                self.intents.add('alarm')
+                self._say(self.text_timeout)
+                self.effects.add(3)
+            elif self.interrupted:
+                self.timer.pause()
+                self.next_state = State.check
+                self._say(u'')
+            elif elapsed != self.elapsed or message != self.message:
+                self._say(message)
+                self.elapsed = elapsed
+
+        elif self.state == State.check:
+            self._show_card(True)
+            if self.all_play:
+                text = self.text_winning_team + u', '.join(u'({}){}'.format(
+                    team.color[0].upper(), team.color[1:]) for team in self.teams) + self.text_no_team
+                self._say(text)
+
+                team_str = u'bmgy'
+                if key in [ord('N'), ord('n')]:
+                    self.active_team = (self.active_team + 1) % self.num_teams
+                    self.next_state = State.pick
+                elif key in [ord(x) for x in team_str + team_str.upper()]:
+                    for team in self.teams:
+                        if team.color[0].upper() == chr(key).upper():
+                            self.active_team = team.id
+                            break
+                    self.next_state = State.roll
+                else:
+                    return
+                self.record_outcome(self.next_state == State.roll)
+                # all play lasts at most 1 round
+                self.all_play = False
+                self._say(text, chr(key).upper())
+                self.intents.add('board')
+                self.effects.add(2)
+            else:
+                self._say(self.text_success_or_fail)
+                if key in [ord(x) for x in 'sSfF']:
+                    upper_key = chr(key).upper()
+                    if upper_key == 'S':
+                        self.next_state = State.roll
+                    else:
+                        self.active_team = (self.active_team + 1) % self.num_teams
+                        self.next_state = State.pick
+                    self.record_outcome(upper_key == 'S')
+                    self._say(self.text_success_or_fail, upper_key)
+                    self.intents.add('board')
+                    self.effects.add(2)
+
+        elif self.state == State.roll:
+            self._say(self.text_dice)
+            self.intents.add('board')
+            if key in [ord(str(x)) for x in range(7)]:
+                if chr(key) == '0':
+                    # roll the dice for a few seconds
+                    self.effects.add(self.random.randint(2, 7), on_tick=self.roll_dice, interval=0.1)
+                else:
+                    self.dice = int(chr(key))
+                    self._say(self.text_dice, str(self.dice))
+                self.effects.add(1, on_done=self.move_forward)
+                self.effects.add(2)
+
+    def category(self):
+        return self.category_of(self.cell, len(self.categories))
+
+    @classmethod
+    def category_of(cls, cell, num_categories):
+        # index of the category highlighted on a cell, None on white cells
+        # where players choose
+        for i, name in enumerate(cls.category_names[:num_categories]):
+            if name.startswith(cell.lower()):
+                return i
+        return None
+
+    def pick_card(self):
+        category = self.category()
+        self.card_index = None
+        if self.sampler and category is not None:
+            # a few more draws to avoid recent cards, at random anyway
+            for _ in range(self.sampler_tries):
+                index = self.sampler.draw(category)
+                card = self.deck.cards[index]
+                if not self._valid(card):
+                    continue
+                self.card_index = index
+                self.card_data = card
+                if not self.card_history.recent(card):
+                    break
+            if self.card_index is not None:
+                self.card_history.record(self.card_data)
+                return
+        self.card_data = self._draw()
+        if self.card_history:
+            # skip the cards played recently, at most as many as the deck
+            # holds in a session, so that draws stay O(1) amortized and a
+            # deck played through entirely repeats instead of stalling
+            while self.skipped < len(self.deck.cards) and self.card_history.recent(self.card_data):
+                self.skipped += 1
+                self.card_data = self._draw()
+            self.card_history.record(self.card_data)
+
+    def _valid(self, card):
+        # rows are parsed when drawn, those not matching the header are
+        # skipped and kept to be reported
+        if len(card) == len(self.categories):
+            return True
+        self.invalid_cards.add(tuple(card))
+        return False
+
+    def _draw(self):
+        for _ in range(len(self.deck.cards)):
+            card = self.deck.draw()
+            if self._valid(card):
+                return card
+        # a deck without a single valid card is still played, with the
+        # missing words left blank
+        return (list(card) + [u''] * len(self.categories))[:len(self.categories)]
+
+    def record_outcome(self, success):
+        category = self.category()
+        if not self.card_history or category is None or not self.card_data:
+            return
+        successes, failures = self.card_history.record_outcome(self.card_data, category, success)
+        if self.sampler and self.card_index is not None:
+            self.sampler.update(self.card_index, category, successes, failures)
+
+    def roll_dice(self):
+        self.dice = self.random.randint(1, 6)
+        self._say(self.text_dice, str(self.dice))
+
+    def move_forward(self):
+        new_position = min(self.positions[self.active_team] + self.dice, len(self.board_str)-1)
+        if self.positions[self.active_team] != new_position:
+            if self.board_str[new_position].isupper():
+                self.all_play = True
+            self._say(self.fmt_moving.format(new_position - self.positions[self.active_team]))
+            self.positions[self.active_team] = new_position
+        else:
+            self._say(self.text_finish_line)
+        self.next_state = State.pick
+        self.intents.add('board')
+
+    def get_state(self):
+        return Checkpoint(
+            self.active_team,
+            tuple(self.positions),
+            self.card_data,
+            self.all_play,
+            self.state)
+
+    def load_state(self, active_team, positions, card_data, all_play, state):
+        # checkpoints are never taken while counting down
+        self.timer.pause()
+        self.card_index = None
+        self.active_team = active_team
+        self.positions = list(positions)
+        self.card_data = card_data
+        self.all_play = all_play
+        self.state = state
+        self.next_state = state
+
+    def get_game(self):
+        return {
+            'categories': self.categories,
+            'deck': self.deck,
+            'num_teams': self.num_teams,
+            'history': self.history,
+            'teams': self.teams,
+            'active_team': self.active_team,
+            'positions': self.positions,
+            'card_data': self.card_data,
+            'timeout': self.timer.duration,
+            'time_left': self.time_left,
+            'all_play': self.all_play,
+            'state': self.state,
+            'cell': self.cell}
+
+    def load_game(self, game):
+        self.categories = game['categories']
+        if 'deck' in game:
+            self.deck = game['deck']
+        else:
+            # older saves store the list of remaining cards
+            self.deck = Deck(game['cards'])
+        self.num_teams = game['num_teams']
+        if 'history' in game:
+            self.history = game['history']
+            self.history.ops = []
+        else:
+            # older saves store every checkpoint in full
+            for state in game['states']:
+                self.history.push(Checkpoint(state[0], tuple(state[1]), *state[2:]))
+        self.teams = game['teams']
+        for team in self.teams:
+            # older saves store the curses attribute along with the color
+            if isinstance(team.color, tuple):
+                team.color = team.color[0]
+        self.active_team = game['active_team']
+        self.positions = game['positions']
+        self.card_data = game['card_data']
+        self.timer.duration = game.get('timeout', self.timer.duration)
+        if 'time_left' in game:
+            self.timer.left = game['time_left']
+        else:
+            # older saves store the wall clock time the countdown started at
+            self.timer.left = min(max(0, self.timer.duration - (time.time() - game['time_start'])),
+                self.timer.duration)
+        self.timer.started = None
+        self.all_play = game['all_play']
+        self.state = game['state']
+        self.next_state = self.state
+        self.cell = game['cell']
+        self.card_index = None
+
+class ManualClock:
+    # clock moving only when told to, so that scripted games take no time
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class Driver:
+    # plays key scripts on an engine running on a ManualClock: strings are
+    # typed one key at a time, numbers are waits in seconds during which the
+    # engine is fed at every wakeup it asks for. The intents returned by the
+    # latest keep feeds are kept, none with keep=0
+    def __init__(self, engine, keep=1000):
+        self.engine = engine
+        self.clock = engine.clock
+        self.intents = deque(maxlen=keep)
+
+    def start(self):
+        self.intents.append(self.engine.start())
+
+    def key(self, key):
+        if isinstance(key, str):
+            key = ord(key)
+        self.intents.append(self.engine.feed(key))
+
+    def wait(self, seconds):
+        end = self.clock.now + seconds
+        while True:
+            wakeup = self.engine.next_wakeup()
+            if wakeup is None or self.clock.now + wakeup > end:
+                break
+            self.clock.now += wakeup
+            self.intents.append(self.engine.feed())
+        self.clock.now = end
+
+    def play(self, script):
+        for item in script:
+            if isinstance(item, str):
+                for key in item:
+                    self.key(key)
+            else:
+                self.wait(item)
+
+def init_colors():
+    # hide the cursor
+    curses.curs_set(False) 
+    # diable newline mode
+    curses.nonl()
+    # categories
+    curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_YELLOW)
+    curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_BLUE)
+    curses.init_pair(3, curses.COLOR_BLACK, curses.COLOR_MAGENTA)
+    curses.init_pair(4, curses.COLOR_BLACK, curses.COLOR_GREEN)
+    curses.init_pair(5, curses.COLOR_BLACK, curses.COLOR_RED)
+    # header and footer
+    curses.init_pair(6, curses.COLOR_BLACK, curses.COLOR_CYAN)
+    # teams
+    curses.init_pair(7, curses.COLOR_BLUE, 0)
+    curses.init_pair(8, curses.COLOR_MAGENTA, 0)
+    curses.init_pair(9, curses.COLOR_GREEN, 0)
+    curses.init_pair(10, curses.COLOR_YELLOW, 0)
+    # board: any color
+    curses.init_pair(11, curses.COLOR_WHITE, curses.COLOR_WHITE)
+    # root background
+    curses.init_pair(12, curses.COLOR_BLACK, curses.COLOR_WHITE)
+
+class Layout:
+    # geometry of the interface windows for a terminal size, with the
+    # characters and attribute of every board cell, computed once and shared
+    # by all the games of the process. Boards too long for a row wrap over
+    # as many rows as needed, each followed by the tracks of the teams
+    min_cols = 104
+    min_lines = 32
+    cache = {}
+    cache_size = 64
+
+    # color pair of the board cells, by lowercase letter
+    cell_pairs = {'y': 1, 'b': 2, 'm': 3, 'g': 4, 'r': 5, '*': 11}
+
+    def __init__(self, lines, cols, board_str, num_teams, num_categories):
+        per_row = (max(cols, self.min_cols) - 10) // 2
+        band = 3 + num_teams
+        # (top, first cell, cells) of every row of the board
+        self.rows = [(top * band, first, min(per_row, len(board_str) - first))
+            for top, first in enumerate(range(0, len(board_str), per_row))]
+        self.board_lines = len(self.rows) * band
+
+        self.cells = []
+        for i, c in enumerate(board_str):
+            chars = Game.text_all_play_marker if c.isupper() else u'  '
+            attr = curses.color_pair(self.cell_pairs.get(c.lower(), 5))
+            self.cells.append((i // per_row * band + 1, 10 + 2 * (i % per_row), chars, attr))
+
+        # category highlighted on each kind of cell
+        self.highlight = dict((c, Engine.category_of(c, num_categories)) for c in set(board_str))
+
+        card_lines = num_categories * 3 + 2
+        card_top = max(9, 2 + self.board_lines)
+        self.lines_needed = max(self.min_lines, card_top + card_lines + 6)
+        self.fits = cols >= self.min_cols and lines >= self.lines_needed
+        self.windows = {
+            'header': (1, cols, 0, 0),
+            'board': (self.board_lines, cols, 1, 0),
+            'card': (card_lines, 40, card_top + (lines - card_lines - card_top - 6) // 2, (cols - 40) // 2),
+            'legend': (3, cols, lines - 6, 0),
+            'footer': (3, cols, lines - 3, 0)}
+
+    @classmethod
+    def get(cls, lines, cols, board_str, num_teams, num_categories):
+        key = (lines, cols, board_str, num_teams, num_categories)
+        layout = cls.cache.get(key)
+        if layout is None:
+            if len(cls.cache) >= cls.cache_size:
+                cls.cache.clear()
+            layout = cls.cache[key] = cls(*key)
+        return layout
+
+class Game:
+    # curses frontend of an Engine
+    category_colors = []
+    team_colors = []
+
+    # all possible interface strings
+    text_header = u'Pyctionary, a word game for geeks. ESC to quit, \'<\' to undo, \'>\' to redo, P to pause'
+    text_save_game = u'Save game? (Y/N) '
+    fmt_last_save = u'(last autosave {:.0f}s ago)'
+    text_autosave_failed = u'(autosave failed: {})'
+    text_all_play = u'ALL PLAY!'
+    chr_active_marker = u'▶'
+    text_all_play_marker = u'◀▶'
+
+    # fields logged to the journal on every transition
+    journal_fields = ['active_team', 'positions', 'card_data', 'time_left', 'all_play', 'state', 'cell']
+
+    def __init__(self, stdscr, engine, restore_file, traffic=None, autosave_interval=1, profiler=None, alarm=None,
+            trace=None):
+        self.stdscr = stdscr
+        self.engine = engine
+        self.alarm = alarm
+        self.trace = trace
+        self.restore_file = restore_file
+        self.journal = Journal(restore_file, autosave_interval)
+        self.journaled = {}
+
+        # remote mode: frame rate cap and output accounting
+        self.traffic = traffic
+        self.frame_due = 0
+        self.frame_pending = False
 
         # actual window size
-        self.y = curses.LINES-1
-        self.x = curses.COLS-1
+        self.y, self.x = [size - 1 for size in stdscr.getmaxyx()]
 
-        # subwindows
+        # windows, kept across resizes, and the length of the team tracks
+        self.layout = None
+        self.windows = {}
+        self.tracks = {}
         self.header = None
         self.board = None
         self.card = None
@@ -85,35 +1688,11 @@ class Game:
 
         # setup
         self.interface_setup()
-        self.team_setup()
-
-    def team_setup(self):
-        for i in range(self.num_teams):
-            self.teams.append(Team(i, color=self.team_colors[i]))
-            self.positions.append(0)
+        if profiler:
+            profiler.attach(self)
 
     def interface_setup(self):
-        # hide the cursor
-        curses.curs_set(False) 
-        # diable newline mode
-        curses.nonl()
-        # categories
-        curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_YELLOW)
-        curses.init_pair(2, curses.COLOR_BLACK, curses.COLOR_BLUE)
-        curses.init_pair(3, curses.COLOR_BLACK, curses.COLOR_MAGENTA)
-        curses.init_pair(4, curses.COLOR_BLACK, curses.COLOR_GREEN)
-        curses.init_pair(5, curses.COLOR_BLACK, curses.COLOR_RED)
-        # header and footer
-        curses.init_pair(6, curses.COLOR_BLACK, curses.COLOR_CYAN)
-        # teams
-        curses.init_pair(7, curses.COLOR_BLUE, 0)
-        curses.init_pair(8, curses.COLOR_MAGENTA, 0)
-        curses.init_pair(9, curses.COLOR_GREEN, 0)
-        curses.init_pair(10, curses.COLOR_YELLOW, 0)
-        # board: any color
-        curses.init_pair(11, curses.COLOR_WHITE, curses.COLOR_WHITE)
-        # root background
-        curses.init_pair(12, curses.COLOR_BLACK, curses.COLOR_WHITE)
+        init_colors()
 
         # define color sets
         self.category_colors = [
@@ -134,484 +1713,2027 @@ class Game:
         # change root background
         #self.stdscr.bkgd(u' ', curses.color_pair(12) | curses.A_BOLD)
 
+    def place(self, name, geometry):
+        # the window of a previous layout is moved and resized rather than
+        # made again. Top-level windows are used, subwindows can not be moved
+        lines, cols, y, x = geometry
+        surface = self.windows.get(name)
+        if surface is not None:
+            try:
+                surface.win.resize(lines, cols)
+                surface.win.mvwin(y, x)
+                surface.reset()
+            except curses.error:
+                surface = None
+        if surface is None:
+            # virtual screens make their own windows
+            newwin = getattr(self.stdscr, 'newwin', curses.newwin)
+            surface = self.windows[name] = Surface(newwin(lines, cols, y, x))
+            surface.keypad(True)
+        setattr(self, name, surface)
+        return surface
+
+    def _layout(self):
+        engine = self.engine
+        return Layout.get(self.y, self.x, engine.board_str, engine.num_teams, len(engine.categories))
+
     def draw_header(self):
-        self.header = self.stdscr.subwin(1, self.x, 0, 0)
+        self.place('header', self.layout.windows['header'])
         self.header.bkgd(u' ', curses.color_pair(6) | curses.A_BOLD)
         self.header.addstr(0, 1, self.text_header, curses.color_pair(6))
 
     def draw_board(self):
-        # board
-        self.board = self.stdscr.subwin(3 + self.num_teams, self.x, 1, 0)
+        # board, its cells only change with the layout
+        self.place('board', self.layout.windows['board'])
+        for y, x, chars, attr in self.layout.cells:
+            self.board.addstr(y, x, chars, attr)
+        self.tracks = {}
         self.update_board()
 
     def update_board(self):
-        for i, c in enumerate(self.board_str):
-            chars = u'  '
-            if c == '*':
-                attr = curses.color_pair(11)
-            else:
-                if c in ['y', 'Y']:
-                    attr = curses.color_pair(1)
-                elif c in ['b', 'B']:
-                    attr = curses.color_pair(2)
-                elif c in ['m', 'M']:
-                    attr = curses.color_pair(3)
-                elif c in ['g', 'G']:
-                    attr = curses.color_pair(4)
-                else:
-                    attr = curses.color_pair(5)
-                if c.isupper():
-                    chars = self.text_all_play_marker  
-            # if (i+1) % 12 == 0:
-            #     chars = u'||'
-            self.board.addstr(1, 10+2*i, chars, attr)
-
-        # teams
-        for team in self.teams:
-            self.board.addstr(3+team.id, 10, (self.positions[team.id] + 1) * u'  ', team.color[1] | curses.A_REVERSE)
-            #self.board.addstr(3+team.id, 1, u' {}'.format(team.color[0]), team.color[1])
-            base_text = u'{:^7s}'.format(team.color[0])
-            args = team.color[1]
-            if self.active_team == team.id:
+        engine = self.engine
+        layout = self.layout
+        # teams, their tracks wrap with the board
+        for team in engine.teams:
+            color = self.team_colors[team.id]
+            base_text = u'{:^7s}'.format(color[0])
+            args = color[1]
+            if engine.active_team == team.id:
                 text = self.chr_active_marker + base_text
                 args |= curses.A_REVERSE
             else:
                 text = u' ' + base_text
-            self.board.addstr(3+team.id, 1, text, args)
+            reached = engine.positions[team.id] + 1
+            for top, first, cells in layout.rows:
+                y = top+3+team.id
+                done = min(max(reached - first, 0), cells)
+                self.board.addstr(y, 10, done * u'  ', color[1] | curses.A_REVERSE)
+                # what is left of a longer track, after an undo
+                drawn = self.tracks.get(y, 0)
+                if drawn > done:
+                    self.board.addstr(y, 10+2*done, (drawn - done) * u'  ')
+                self.tracks[y] = done
+                self.board.addstr(y, 1, text, args)
 
     def draw_card(self):
-        tot_y = len(self.categories)*3+2
-        tot_x = 40
-
-        self.card = self.stdscr.subwin(tot_y, tot_x, 9+(self.y-tot_y-9-6)//2, (self.x-tot_x)//2)
+        self.place('card', self.layout.windows['card'])
         self.card.box()
+        self.render_card()
+
+    def render_card(self):
+        if self.engine.card_visible:
+            self.update_card()
+        else:
+            self.blank_card()
 
     def update_card(self):
-        for i, _ in enumerate(self.categories):
+        highlight = self.layout.highlight.get(self.engine.cell)
+        for i, _ in enumerate(self.engine.categories):
             self.card.addstr(1+i*3, 1, u' '*38, self.category_colors[i][1])
-            text = self.card_data[i]
+            text = self.engine.card_data[i]
             args = self.category_colors[i][1]
-            if self.category_colors[i][0].startswith(self.cell.lower()):
+            if i == highlight:
                 text = u'*** {} ***'.format(text)
             self.card.addstr(2+i*3, 1, u'{:^38s}'.format(text), args)
             self.card.addstr(3+i*3, 1, u' '*38, self.category_colors[i][1])
 
     def blank_card(self):
-        for i, _ in enumerate(self.categories):
+        for i, _ in enumerate(self.engine.categories):
             self.card.addstr(1+i*3, 1, u' '*38)
             self.card.addstr(2+i*3, 1, u' '*38)
             self.card.addstr(3+i*3, 1, u' '*38)
 
     def draw_legend(self):
         padding = 0
-        self.legend = self.stdscr.subwin(3, self.x, self.y-3-3, 0)
-        for i, cat in enumerate(self.categories):
+        self.place('legend', self.layout.windows['legend'])
+        for i, cat in enumerate(self.engine.categories):
             self.legend.addstr(1, 10+padding, u' {} '.format(cat), self.category_colors[i][1])
             padding += len(cat)+3
 
     def draw_footer(self):
-        self.footer = self.stdscr.subwin(3, self.x, self.y-3, 0)
-        self.footer.bkgd(u' ', curses.color_pair(6))
+        self.place('footer', self.layout.windows['footer'])
+        self.update_footer()
+
+    def update_footer(self):
+        engine = self.engine
+        self.footer.erase()
+        if engine.all_play:
+            self.footer.bkgd(u' ', curses.color_pair(1))
+        else:
+            self.footer.bkgd(u' ', curses.color_pair(6))
+        self.footer.addstr(1, 1, engine.message + engine.answer)
+        if engine.elapsed is not None:
+            self.update_countdown(engine.elapsed)
+        if engine.all_play:
+            self.footer.addstr(1, self.x-10, self.text_all_play)
+
+    def update_countdown(self, elapsed):
+        # a column per second, scaled down when it does not fit the footer
+        timeout = self.engine.timer.duration
+        width = min(timeout, self.x - 46)
+        gone = elapsed * width // timeout
+        # dark (or red) stripe
+        self.footer.addstr(1, 34, u' '*width,
+            curses.color_pair(5) if 10 > (timeout - elapsed) else curses.A_REVERSE)
+        # white stripe
+        self.footer.addstr(1, 34 + (width - gone),
+            u' '*gone, curses.color_pair(11))
 
     def draw_interface(self):
+        self.layout = self._layout()
         self.draw_header()
         self.draw_board()
         self.draw_card()
         self.draw_legend()
         self.draw_footer()
-        self.stdscr.refresh()
 
-    def pick_card(self):
-        idx = random.choice(range(len(self.cards)))
-        self.card_data = self.cards[idx]
-        del self.cards[idx]
-
-    def update_countdown(self, elapsed):
-        # dark (or red) stripe
-        self.footer.addstr(1, 34, u' '*self.timeout,
-            curses.color_pair(5) if 10 > (self.timeout - elapsed) else curses.A_REVERSE)
-        # white stripe
-        self.footer.addstr(1, 34 + (self.timeout - elapsed),
-            u' '*elapsed, curses.color_pair(11))
+    def render(self, intents):
+        if 'board' in intents:
+            self.update_board()
+        if 'card' in intents:
+            self.render_card()
+        if 'footer' in intents:
+            self.update_footer()
+        if 'alarm' in intents and self.alarm:
+            self.alarm.play()
+
+    def commit(self, force=False):
+        # send the whole frame to the terminal with a single update, in remote
+        # mode frames coming too fast are held back and merged with the next
+        now = time.monotonic()
+        if self.traffic and not force and now < self.frame_due:
+            self.frame_pending = True
+            return
+        self.stdscr.noutrefresh()
+        runs = []
+        for surface in [self.header, self.board, self.card, self.legend, self.footer]:
+            runs += surface.noutrefresh()
+        curses.doupdate()
+        self.frame_pending = False
+        if self.traffic and runs:
+            self.traffic.add_frame(self.engine.state.name, runs)
+            self.frame_due = now + 1 / self.traffic.max_fps
+
+    def wait_key(self, timeout):
+        # commit the frame and wait up to timeout milliseconds for a key,
+        # waking up earlier to flush a frame held back by the frame cap
+        self.commit()
+        if self.frame_pending:
+            due = max(0, int((self.frame_due - time.monotonic()) * 1000) + 1)
+            timeout = due if timeout < 0 else min(timeout, due)
+        self.footer.timeout(timeout)
+        return self.footer.getch()
+
+    def _next_wakeup(self):
+        # milliseconds until the engine needs to be fed, -1 to block until a
+        # key is pressed
+        wakeup = self.engine.next_wakeup()
+        if wakeup is None:
+            return -1
+        return int(wakeup * 1000) + 1
 
     def check_size(self):
         if not self._big_enough():
             saved = False
-            if self.states:
+            if self.engine.history:
                 self.save_game()
-                saved = True
-            raise ScreenTooSmall(saved)
+                self.journal.close()
+                saved = not self.journal.error
+            raise ScreenTooSmall(saved, self._layout().lines_needed, Layout.min_cols, self.journal.error)
 
     def _big_enough(self):
         self.y, self.x = self.stdscr.getmaxyx()
-        if self.x < 104 or self.y < 32:
-            return False
-        return True
-
-    def get_state(self):
-        return [
-            self.active_team,
-            copy(self.positions),
-            copy(self.card_data),
-            self.all_play,
-            self.state,
-        ]
-
-    def load_state(self, active_team, positions, card_data, all_play, state):
-        self.active_team = active_team
-        self.positions = positions
-        self.card_data = card_data
-        self.all_play = all_play
-        self.state = state
+        return self._layout().fits
 
     def save_game(self):
-        obj = {
-            'categories': self.categories,
-            'cards': self.cards,
-            'num_teams': self.num_teams,
-            'states': self.states,
-            'teams': self.teams,
-            'active_team': self.active_team,
-            'positions': self.positions,
-            'card_data': self.card_data,
-            'time_start': self.time_start,
-            'all_play': self.all_play,
-            'state': self.state,
-            'cell': self.cell}
-        with open(self.restore_file, 'wb') as f:
-            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-
-    def restore_game(self, fname=False):
-        restore_file = fname if fname else self.restore_file
-        with open(restore_file, 'rb') as f:
-            game = pickle.load(f)
-        self.categories = game['categories']
-        self.cards = game['cards']
-        self.num_teams = game['num_teams']
-        self.states = game['states']
-        self.teams = game['teams']
-        self.active_team = game['active_team']
-        self.positions = game['positions']
-        self.card_data = game['card_data']
-        self.time_start = game['time_start']
-        self.all_play = game['all_play']
-        self.state = game['state']
-        self.cell = game['cell']
-
-    def loop(self):
-        self.state_prev = ''
-        self.next_state = self.state
-        self.all_play_prev = False
+        self.engine.history.ops = []
+        self.journal.snapshot(self.engine.get_game())
+        self.journaled = self._journal_values()
+
+    def journal_event(self):
+        # log the fields changed since the previous record, the whole game
+        # again when a write failed
+        if self.journal.events >= self.journal.snapshot_every or self.journal.error:
+            self.save_game()
+            return
+        values = self._journal_values()
+        changes = dict((name, value) for name, value in values.items()
+            if self.journaled.get(name) != value)
+        history = self.engine.history
+        if history.ops:
+            changes['history'] = history.ops
+            history.ops = []
+        if changes:
+            self.journal.event(changes)
+            self.journaled = values
+
+    def _journal_values(self):
+        values = dict((name, copy(getattr(self.engine, name))) for name in self.journal_fields)
+        values['deck'] = (self.engine.deck.shuffles, self.engine.deck.pos)
+        return values
+
+    def save_prompt(self):
+        self.show_save_prompt()
+        self.footer.timeout(-1)
+        while True:
+            key = self.footer.getch()
+            if key in [ord(x) for x in 'yYnN']:
+                break
+        self.quit(chr(key).upper() == 'Y')
+
+    def show_save_prompt(self):
+        self.footer.erase()
+        self.footer.addstr(1,1, self.text_save_game)
+        if self.journal.error:
+            self.footer.addstr(1, 40, self.text_autosave_failed.format(self.journal.error))
+        elif self.journal.since_save() is not None:
+            self.footer.addstr(1, 40, self.fmt_last_save.format(self.journal.since_save()))
+        self.commit(force=True)
+
+    def quit(self, save):
+        if save:
+            self.save_game()
+            self.journal.close()
+            raise GameTerminated(saved=not self.journal.error, error=self.journal.error)
+        else:
+            self.journal.discard()
+            raise GameTerminated(saved=False)
+
+    def resize(self):
+        # the countdown stops while the screen is too small to show it
+        running = self.engine.timer.running
+        self.engine.pause()
+        # clear the screen to avoid artifacts
+        self.stdscr.erase()
+        # update screen size, waiting for the screen to get big enough
+        if not self._big_enough():
+            while not self._big_enough():
+                self.show_too_small()
+                self.stdscr.getch()
+            self.stdscr.erase()
+        if running:
+            self.engine.resume()
+        self.draw_interface()
 
-        key = 0
+    def show_too_small(self):
+        self.stdscr.erase()
+        self.stdscr.addstr(1, 1, u'Screen too small!')
+        self.stdscr.refresh()
 
+    def begin(self):
         self.check_size()
+        intents = self.engine.start()
+        # first frame, then the first save
         self.draw_interface()
+        self.render(intents)
+        self.commit()
+        if self.trace:
+            self.trace.mark('first frame')
+        self.save_game()
 
-        while True: 
-            # ESC to quit
+    def loop(self):
+        self.begin()
+        while True:
+            if not self.engine.effects:
+                self.journal_event()
+            # block until a key is pressed or the engine needs to be fed
+            key = self.wait_key(self._next_wakeup())
+
+            # ESC to quit, after playing out running effects
             if key == 27:
-                self.footer.clear()
-                self.footer.addstr(1,1, self.text_save_game)
-                self.footer.refresh()
-                while True:
-                    key = self.footer.getch()
-                    if key in [ord(x) for x in 'yYnN']:
-                        break
-                if chr(key).upper() == 'Y':
-                    self.save_game()
-                    raise GameTerminated(saved=True)
-                else:
-                    raise GameTerminated(saved=False)
-
-            # resize window
+                self.render(self.engine.feed(key))
+                self.save_prompt()
+            # resize window, running effects carry on
             elif key == curses.KEY_RESIZE:
-                # clear the screen to avoid artifacts
-                self.stdscr.erase()
-                # update screen size
-                if not self._big_enough():
-                    self.stdscr.erase()
-                    self.stdscr.addstr(1, 1, u'Screen too small!')
-                    self.stdscr.refresh()
-                    key = self.stdscr.getch()
-                    continue
-                else:
-                    self.draw_interface()
-            elif key == ord('<'):
-                if len(self.states) > 0:
-                    if self.state in [State.check, State.roll] \
-                    or self.state == State.pick and len(self.states) > 1:
-                        del self.states[-1]
-                    self.load_state(*self.states[-1])
-                    self.next_state = self.state
-                    self.stdscr.erase()
-                    self.draw_interface()
-                    self.stdscr.refresh()
+                self.resize()
             else:
-                if self.state_prev != self.state \
-                and self.state in [State.pick, State.check, State.roll]:
-                    self.states.append(self.get_state())
+                self.render(self.engine.feed(key))
 
-            if self.all_play:
-                self.footer.bkgd(u' ', curses.color_pair(1))
-            else:
-                self.footer.bkgd(u' ', curses.color_pair(6))
-
-            # game automaton
-            if self.state == State.pick:
-                # game
-                self.cell = self.board_str[self.positions[self.active_team]]
-                if key in [curses.KEY_ENTER, 10, 13]:
-                    self.pick_card()
-                    self.next_state = State.watch
-                    curses.ungetch(128)
-                # interface
-                self.blank_card()
-                self.card.refresh()
-                self.footer.clear()
-                self.footer.addstr(1, 1, self.text_pick_card)
-                self.footer.refresh()
-
-            elif self.state == State.watch:
-                # game
-                if key in [curses.KEY_ENTER, 10, 13]:
-                    self.next_state = State.getready
-                    curses.ungetch(128)
-                # interface (display card)
-                self.update_card()
-                self.card.refresh()
-                self.footer.clear()
-                self.footer.addstr(1, 1, self.text_hide_card)
-                self.footer.refresh()
-
-            elif self.state == State.getready:
-                if key in [curses.KEY_ENTER, 10, 13]:
-                    self.next_state = State.draw
-                    curses.ungetch(128)
-                # interface (blank card and add countdown text in the footer)
-                self.blank_card()
-                self.card.refresh()
-                self.footer.clear()
-                self.footer.addstr(1, 1, self.text_getready)
-                self.footer.refresh()                
-
-            elif self.state == State.draw:
-                # game
-                self.time_start = time.time()
-                Game.interrupted = False
-                self.next_state = State.countdown
-                curses.ungetch(128)
-
-            elif self.state == State.countdown:
-                # game
-                elapsed = int(time.time() - self.time_start)
-                if elapsed > self.timeout:
-                    self.next_state = State.check
-                    # interface
-                    try:
-                        subprocess.Popen(['aplay', 'data/alarm.wav'], stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-                    except:
-                        pass
-                    self.footer.clear()
-                    self.footer.addstr(1, 1, self.text_timeout)
-                    self.footer.refresh()
-                    curses.napms(3000)
-                    curses.ungetch(128)
-                elif Game.interrupted:
-                    self.next_state = State.check
-                    curses.ungetch(128)
-                    # interface
-                    self.footer.clear()
-                else:
-                    try:
-                        curses.ungetch(128)
-                    except:
-                        pass
-                    # interface
-                    self.footer.addstr(1, 1, self.text_countdown)
-                    self.update_countdown(elapsed)
-                # interface
-                self.footer.refresh()
-
-            elif self.state == State.check:
-                # interface
-                self.update_card()
-                self.card.refresh()
-                self.footer.clear()
-
-                # game
-                if self.all_play:
-                    # interface
-                    text = u'Winning team '
-                    self.footer.addstr(1, 1, text)
-                    needle = len(text)
-                    text = u', '.join(u'({}){}'.format(team.color[0][0].upper(), team.color[0][1:]) for team in self.teams)
-                    text += u', (N)one: '
-                    self.footer.addstr(1, 1 + needle, text)
-
-                    team_str = u'bmgy'
-                    if key in [ord('N'), ord('n')]:
-                        self.active_team = (self.active_team + 1) % self.num_teams
-                        self.next_state = State.pick
-                        # all play lasts at most 1 round
-                        self.all_play = False
-                        curses.ungetch(128)
-                        # interface
-                        self.update_board()
-                        self.board.refresh()
-                        self.footer.addch(chr(key).upper())
-                        self.footer.refresh()
-                        curses.napms(2000)
-                    elif key in [ord(x) for x in team_str + team_str.upper()]:
-                        for team in self.teams:
-                            if team.color[0][0].upper() == chr(key).upper():
-                                self.active_team = team.id
-                                break
-                        self.next_state = State.roll
-                        # all play lasts at most 1 round
-                        self.all_play = False
-                        curses.ungetch(128)
-                        # interface
-                        self.footer.addch(chr(key).upper())
-                        self.footer.refresh()
-                        curses.napms(2000)
-                else:
-                    # interface
-                    self.footer.addstr(1, 1, self.text_success_or_fail)
-
-                    if key in [ord(x) for x in 'sSfF']:
-                        upper_key = chr(key).upper()
-                        if upper_key == 'S':
-                            self.next_state = State.roll
-                        else:
-                            self.active_team = (self.active_team + 1) % self.num_teams
-                            self.next_state = State.pick    
-                        curses.ungetch(128)
-                        # interface
-                        self.update_board()
-                        self.board.refresh()
-                        self.footer.addch(upper_key)
-                        self.footer.refresh()
-                        curses.napms(2000)
-
-            elif self.state == State.roll:
-                # interface
-                self.update_board()
-                self.board.refresh()
-                self.footer.clear()
-                self.footer.addstr(1, 1, self.text_dice)
-
-                # game
-                if key in [ord(str(x)) for x in range(7)]:
-                    if chr(key) == '0':
-                        t = time.time()
-                        tout = random.randint(2,7)
-                        result = 1
-                        while (time.time()-t) < tout:
-                            result = random.randint(1, 6)
-                            self.footer.addch(1, len(self.text_dice) + 1, str(result))
-                            self.footer.refresh()
-                            curses.napms(100)
-                    else:
-                        result = int(chr(key))
-                        self.footer.addch(1, len(self.text_dice) + 1, str(result))
-                    self.footer.refresh()
-                    curses.napms(1000)
-
-                    new_position = min(self.positions[self.active_team] + result, len(self.board_str)-1)
-                    # interface
-                    self.footer.erase()
-                    if self.positions[self.active_team] != new_position:
-                        if self.board_str[new_position].isupper():
-                            self.all_play = True
-                        # interface
-                        self.footer.addstr(1, 1, self.fmt_moving.format(new_position - self.positions[self.active_team]))
-                        # game
-                        self.positions[self.active_team] = new_position
-                    else:
-                        # interface
-                        self.footer.addstr(1, 1, self.text_finish_line)
-                    # game
-                    self.next_state = State.pick
-                    # interface
-                    self.footer.refresh()
-                    self.update_board()
-                    self.board.refresh()
-                    curses.ungetch(128)
-                    curses.napms(2000)
-
-            if self.all_play:
-                self.footer.addstr(1, self.x-10, u'ALL PLAY!') 
-            else:
-                self.footer.addstr(1, self.x-10, u' '*9)
-
-
-            key = self.footer.getch()
-            self.state_prev = self.state
-            self.state = self.next_state
-            self.all_play_prev = self.all_play
-
-            curses.napms(10)
+def open_cards(path):
+    # compiled decks are recognized by their magic, anything else is csv
+    with open(path, 'rb') as f:
+        magic = f.read(len(CompiledDeck.magic))
+    if magic == CompiledDeck.magic:
+        return CompiledDeck(path)
+    return CardStore(path)
 
 def load_cards(path):
-    cards = []
     try:
-        with open(path) as f:
-            cards = [card for card in csv.reader(f)]
-    except:
-        die(u'Unable to load the card file, aborting.\n')
-    return cards
+        cards = open_cards(path)
+    except OSError as e:
+        die(u'Unable to load the card file {}: {}\n'.format(path, e.strerror))
+    except (ValueError, struct.error) as e:
+        die(u'Unable to load the card file {}: {}, check it with the deck command.\n'.format(path, e))
+    if not len(cards):
+        die(u'The card file contains no cards, aborting.\n')
+    return cards.categories, cards
+
+def open_card_history(args):
+    if not args.card_history:
+        return None
+    import sqlite3
+    try:
+        return CardHistory(args.card_history, args.history_days)
+    except sqlite3.Error as e:
+        die(u'Unable to open the card history {}: {}\n'.format(args.card_history, e))
 
-def signal_handler(signal, frame):
-    Game.interrupted = True
+def compile_deck(path, output):
+    try:
+        cards = CardStore(path)
+    except OSError as e:
+        die(u'Unable to load the card file {}: {}\n'.format(path, e.strerror))
+    except ValueError as e:
+        die(u'Unable to load the card file {}: {}, check it with the deck command.\n'.format(path, e))
+    try:
+        CompiledDeck.compile(cards, output)
+    except ValueError as e:
+        die(u'{}, aborting.\n'.format(e))
+    except OSError as e:
+        die(u'Unable to write {}: {}\n'.format(output, e.strerror))
+    sys.stderr.write(u'Compiled {} cards into {}\n'.format(len(cards), output))
+
+def merge_decks(paths, output=None, max_errors=10):
+    # streams the card files one row at a time and writes the valid cards to
+    # output, only the hashes of the words seen are kept in memory. Rows not
+    # matching the header or with an empty word are reported and dropped, so
+    # are cards repeating a word already seen in the same category (ignoring
+    # case and surrounding blanks)
+    import csv
+    categories = None
+    seen = None
+    writer = None
+    out = None
+    cards = invalid = 0
+    duplicates = []
+    try:
+        for path in paths:
+            with open(path, newline='', encoding='utf-8-sig', buffering=1 << 20) as f:
+                reader = csv.reader(f)
+                header = [name.strip() for name in next(reader, [])]
+                if categories is None:
+                    if not header:
+                        die(u'{}: no header, aborting.\n'.format(path))
+                    categories = header
+                    seen = [set() for _ in categories]
+                    duplicates = [0] * len(categories)
+                    if output:
+                        out = open(output + '.tmp', 'w', newline='', encoding='utf-8', buffering=1 << 20)
+                        writer = csv.writer(out)
+                        writer.writerow(categories)
+                elif header != categories:
+                    die(u'{}: categories {} differ from {}, aborting.\n'.format(
+                        path, u', '.join(header), u', '.join(categories)))
+                expected = len(categories)
+                # the work per row is kept to a few calls running in C
+                strip = str.strip
+                casefold = str.casefold
+                contains = set.__contains__
+                for row in reader:
+                    if not row:
+                        continue
+                    words = list(map(strip, row))
+                    if len(words) != expected or not all(words):
+                        invalid += 1
+                        if invalid <= max_errors:
+                            problem = u'{} fields, {} expected'.format(len(words), expected) \
+                                if len(words) != expected else u'empty word'
+                            sys.stderr.write(u'{}:{}: {}\n'.format(path, reader.line_num, problem))
+                        continue
+                    keys = list(map(hash, map(casefold, words)))
+                    if any(map(contains, seen, keys)):
+                        for i, key in enumerate(keys):
+                            duplicates[i] += key in seen[i]
+                        continue
+                    for key, hashes in zip(keys, seen):
+                        hashes.add(key)
+                    if writer:
+                        writer.writerow(words)
+                    cards += 1
+        if out:
+            out.close()
+            os.replace(output + '.tmp', output)
+    except OSError as e:
+        die(u'{}: {}\n'.format(e.filename or output, e.strerror))
+    except (UnicodeDecodeError, csv.Error) as e:
+        die(u'{}: {}, aborting.\n'.format(path, e))
+    finally:
+        if out and not out.closed:
+            out.close()
+            os.remove(output + '.tmp')
+    if invalid > max_errors:
+        sys.stderr.write(u'... and {} more invalid rows\n'.format(invalid - max_errors))
+    sys.stderr.write(u'{} cards{}, {} invalid rows, {} duplicates{}\n'.format(
+        cards, u' written to {}'.format(output) if output else u'', invalid, sum(duplicates),
+        u' ({})'.format(u', '.join(u'{} {}'.format(count, name) for name, count in zip(categories, duplicates) if count))
+        if sum(duplicates) else u''))
+    return cards, invalid, sum(duplicates)
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description=u'Pyctionary, a word game for geeks')
     parser.add_argument('--teams', type=int, default=2, help='Number of teams (must be between 2-4, default is 2)')
-    parser.add_argument('--cards', type=str, default='cards/it.csv', help='Path to a card file (must be in csv format, default to cards/it.csv)')
+    parser.add_argument('--cards', type=str, default='cards/it.csv', help='Path to a card file (csv or compiled deck, default to cards/it.csv)')
     parser.add_argument('--restore', type=str, help='Restore a previous game state')
+    parser.add_argument('--seed', type=int, help='Seed used to shuffle the deck and roll the dice')
+    parser.add_argument('--remote', action='store_true', help='Low-bandwidth mode for SSH and serial consoles, prints a traffic summary at exit')
+    parser.add_argument('--max-fps', type=int, default=10, help='Maximum frame rate in remote mode (default is 10)')
+    parser.add_argument('--timeout', type=int, default=60, help='Seconds to draw a card (default is 60, restored games keep theirs)')
+    parser.add_argument('--card-history', type=str, metavar='PATH', help='Remember the cards played across sessions in a SQLite database')
+    parser.add_argument('--history-days', type=float, default=30, help='Days before a card played can come up again (default is 30)')
+    parser.add_argument('--difficulty', type=float, help='Draw cards failed about this often (0-1), from the outcomes in the card history')
+    parser.add_argument('--undo-depth', type=int, default=100, help='Number of steps that can be undone (default is 100)')
+    parser.add_argument('--autosave-interval', type=float, default=1, help='Minimum number of seconds between two autosaves (default is 1)')
+    parser.add_argument('--audio', choices=['aplay', 'none'], default='aplay', help='Alarm player (default is aplay, none to stay silent)')
+    parser.add_argument('--profile', type=str, metavar='PATH', help='Print latency histograms at exit and write a cProfile dump of the game to PATH')
+    parser.add_argument('--startup-trace', action='store_true', help='Print at exit the time spent in each phase of the startup')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    compile_parser = subparsers.add_parser('compile-deck', help='Compile a csv card file into a binary deck')
+    compile_parser.add_argument('csv', help='Path to the csv card file')
+    compile_parser.add_argument('output', help='Path of the compiled deck')
+    deck_parser = subparsers.add_parser('deck', help='Check csv card files for invalid rows and duplicates, and merge them')
+    deck_parser.add_argument('csv', nargs='+', help='Paths to the csv card files, all with the same categories')
+    deck_parser.add_argument('--output', type=str, help='Write the valid cards without duplicates to this csv file')
+    deck_parser.add_argument('--max-errors', type=int, default=10, help='Invalid rows reported one by one (default is 10)')
+    simulate_parser = subparsers.add_parser('simulate', help='Simulate games to tune the board and the rules')
+    simulate_parser.add_argument('--games', type=int, default=100000, help='Number of games (default is 100000)')
+    simulate_parser.add_argument('--teams', type=int, default=2, help='Number of teams (must be between 2-4, default is 2)')
+    simulate_parser.add_argument('--board', type=str, help='Board string (default to the game board)')
+    simulate_parser.add_argument('--success', type=float, nargs=5, default=[0.5]*5, metavar='P',
+        help='Probability of guessing a card of the yellow, blue, magenta, green and red categories (default is 0.5)')
+    simulate_parser.add_argument('--seed', type=int, help='Seed of the simulation')
+    simulate_parser.add_argument('--workers', type=int, help='Number of worker processes (default to the number of cores)')
+    simulate_parser.add_argument('--batch-size', type=int, default=50000, help='Games simulated at once by a worker (default is 50000)')
+    simulate_parser.add_argument('--max-turns', type=int, default=10000, help='Turns after which a game is abandoned (default is 10000)')
+    simulate_parser.add_argument('--json', action='store_true', help='Print the report as json')
+    analyze_parser = subparsers.add_parser('analyze', help='Replay saved games and report statistics on them')
+    analyze_parser.add_argument('saves', nargs='+', help='Saved games, or directories of them')
+    analyze_parser.add_argument('--workers', type=int, help='Number of worker processes (default to the number of cores)')
+    analyze_parser.add_argument('--json', action='store_true', help='Print the statistics of every game as json')
+    analyze_parser.add_argument('--csv', type=str, metavar='DIR', help='Write the games, turns and progress of the teams as csv tables to DIR')
+    serve_parser = subparsers.add_parser('serve', help='Host games for thin clients')
+    serve_parser.add_argument('address', help='HOST:PORT or unix:PATH to listen on')
+    serve_parser.add_argument('--save-dir', type=str, default='/tmp', help='Directory of the hosted games saves (default is /tmp)')
+    connect_parser = subparsers.add_parser('connect', help='Play a game hosted by a server')
+    connect_parser.add_argument('address', help='HOST:PORT or unix:PATH of the server')
+    connect_parser.add_argument('--game', type=str, help='Name of the game, to resume a saved one')
+    watch_parser = subparsers.add_parser('watch', help='Watch the board of a game hosted by a server')
+    watch_parser.add_argument('address', help='HOST:PORT or unix:PATH of the server')
+    watch_parser.add_argument('game', help='Name of the game')
+    loadtest_parser = subparsers.add_parser('loadtest', help='Drive simulated clients against a server')
+    loadtest_parser.add_argument('address', help='HOST:PORT or unix:PATH of the server')
+    loadtest_parser.add_argument('--clients', type=int, default=100, help='Number of clients (default is 100)')
+    loadtest_parser.add_argument('--duration', type=float, default=30, help='Seconds of play (default is 30)')
+    loadtest_parser.add_argument('--spectators', type=int, default=0, help='Number of spectators, spread over the games (default is 0)')
+    loadtest_parser.add_argument('--spectator-delay', type=float, default=0, help='Seconds a spectator waits after each message, to simulate slow ones')
+    loadtest_parser.add_argument('--pace', type=float, default=1, help='Scale of the pauses between keys, lower is faster (default is 1)')
+    bench_parser = subparsers.add_parser('bench', help='Run the benchmarks on a virtual screen')
+    bench_parser.add_argument('--output', type=str, help='Write the results as json to this file')
+    bench_parser.add_argument('--compare', type=str, help='Results of a previous run to check for regressions')
+    bench_parser.add_argument('--threshold', type=float, default=0.25, help='Slowdown or memory growth counted as a regression (default is 0.25)')
+    bench_parser.add_argument('--quick', action='store_true', help='Skip the largest decks and histories')
+    bench_parser.add_argument('--startup-cards', type=str, default='cards/it.csv', help='Card file of the game launched to time the startup (default to cards/it.csv)')
+    bench_parser.add_argument('--startup-budget', type=float, default=1, help='Seconds allowed to the first frame (default is 1)')
     args = parser.parse_args()
 
     return args
 
+class VirtualWindow:
+    # stand-in for a curses window keeping the screen in memory, so that the
+    # interface runs without a terminal. Cells are stored with the background
+    # of their window and the cells written since the last frame are tracked,
+    # so that a frame can be sent to a remote terminal
+    blank = (u' ', 0, 0)
+
+    def __init__(self, lines, cols, y=0, x=0, screen=None, changed=None):
+        self.lines = lines
+        self.cols = cols
+        self.y = y
+        self.x = x
+        self.screen = {} if screen is None else screen
+        self.changed = set() if changed is None else changed
+        self.background = 0
+        self.keys = deque()
+        self.root = screen is None
+
+    def subwin(self, lines, cols, y, x):
+        return VirtualWindow(lines, cols, y, x, self.screen, self.changed)
+
+    # windows are all views of the same screen
+    newwin = subwin
+
+    def mvwin(self, y, x):
+        self.y = y
+        self.x = x
+
+    def addstr(self, y, x, text, attr=0):
+        for i, ch in enumerate(text):
+            self.screen[self.y+y, self.x+x+i] = (ch, attr, self.background)
+            self.changed.add((self.y+y, self.x+x+i))
+
+    def _cells(self):
+        return [(y, x) for y in range(self.y, self.y+self.lines) for x in range(self.x, self.x+self.cols)]
+
+    def erase(self):
+        cells = self._cells()
+        self.screen.update(dict.fromkeys(cells, (u' ', 0, self.background)))
+        self.changed.update(cells)
+
+    clear = erase
+
+    def bkgd(self, ch, attr=0):
+        self.background = attr
+        for cell in self._cells():
+            self.screen[cell] = self.screen.get(cell, self.blank)[:2] + (attr,)
+            self.changed.add(cell)
+
+    def resize(self, lines, cols):
+        self.lines = lines
+        self.cols = cols
+        # resizing the screen drops what falls outside
+        if not self.root:
+            return
+        for y, x in list(self.screen):
+            if y >= lines or x >= cols:
+                del self.screen[y, x]
+        self.changed.clear()
+
+    def cell(self, y, x):
+        # character and attribute shown, the background supplies the color
+        # pair of cells without one and adds its other attributes
+        ch, attr, background = self.screen.get((y, x), self.blank)
+        if attr & curses.A_COLOR:
+            return ch, attr | (background & ~curses.A_COLOR)
+        return ch, attr | background
+
+    def frame(self):
+        # cells written since the previous frame, in runs of the same row and
+        # attribute as [y, x, text, attr]
+        runs = []
+        for y, x in sorted(self.changed):
+            if y >= self.lines or x >= self.cols:
+                continue
+            ch, attr = self.cell(y, x)
+            run = runs[-1] if runs else None
+            if run and run[0] == y and run[1] + len(run[2]) == x and run[3] == attr:
+                run[2] += ch
+            else:
+                runs.append([y, x, ch, attr])
+        self.changed.clear()
+        return runs
+
+    def getmaxyx(self):
+        return self.lines, self.cols
+
+    def getbegyx(self):
+        return self.y, self.x
+
+    def getch(self):
+        return self.keys.popleft() if self.keys else -1
+
+    def box(self):
+        pass
+
+    def timeout(self, delay):
+        pass
+
+    def keypad(self, flag):
+        pass
+
+    def noutrefresh(self):
+        pass
+
+    def refresh(self):
+        pass
+
+class virtual_curses:
+    # replaces the curses functions needing a terminal while the interface
+    # runs on a VirtualWindow
+    names = ['color_pair', 'init_pair', 'curs_set', 'nonl', 'doupdate']
+
+    def __init__(self, lines=40, cols=120):
+        self.lines = lines
+        self.cols = cols
+
+    def __enter__(self):
+        self.saved = dict((name, getattr(curses, name)) for name in self.names if hasattr(curses, name))
+        curses.color_pair = lambda n: n << 8
+        curses.init_pair = curses.curs_set = curses.nonl = curses.doupdate = lambda *args: None
+        return VirtualWindow(self.lines, self.cols)
+
+    def __exit__(self, *exc):
+        for name in self.names:
+            if name in self.saved:
+                setattr(curses, name, self.saved[name])
+            else:
+                delattr(curses, name)
+
+def write_synthetic_deck(path, size, categories=5):
+    import csv
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([u'category {}'.format(i) for i in range(categories)])
+        for n in range(size):
+            writer.writerow([u'word {} {}'.format(n, i) for i in range(categories)])
+
+def benchmark(results, name, run, ops, setup=None, repeat=3):
+    # best time per operation over repeat runs, and the peak memory
+    # allocated by one more run
+    import tracemalloc
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    state = setup() if setup else None
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results[name] = {'time': best / ops, 'peak': peak}
+    sys.stderr.write(u'{:<24s} {:12.3f} us/op {:12d} bytes peak\n'.format(name, best / ops * 1e6, peak))
+
+def run_benchmarks(quick=False):
+    import shutil
+    import tempfile
+    results = {}
+    sizes = [1000, 10000, 100000] + ([] if quick else [1000000])
+    depths = [100, 1000] + ([] if quick else [10000])
+    tmp = tempfile.mkdtemp(prefix='pyctionary_bench_')
+    try:
+        with virtual_curses() as stdscr:
+            categories = [u'category {}'.format(i) for i in range(5)]
+            cards = [[u'word {} {}'.format(n, i) for i in range(5)] for n in range(1000)]
+
+            def new_game():
+                engine = Engine(categories, Deck(cards, 1), 4, clock=ManualClock(), seed=1)
+                game = Game(stdscr, engine, os.path.join(tmp, 'render.pickle'))
+                game.draw_interface()
+                game.render(engine.start())
+                game.commit()
+                return game
+
+            def render_board(game):
+                for i in range(1000):
+                    game.engine.positions[i % 4] = i % len(game.engine.board_str)
+                    game.engine.active_team = i % 4
+                    game.update_board()
+                    game.commit()
+            benchmark(results, 'render_board', render_board, 1000, new_game)
+
+            def render_interface(game):
+                for _ in range(100):
+                    game.draw_interface()
+                    game.commit()
+            benchmark(results, 'render_interface', render_interface, 100, new_game)
+
+            def resize_storm(game):
+                # a tiling window manager dragging the terminal around
+                for i in range(200):
+                    stdscr.resize(32 + i % 20, 104 + i % 60)
+                    game.resize()
+                    game.commit()
+                stdscr.resize(40, 120)
+            benchmark(results, 'resize_storm', resize_storm, 200, new_game)
+
+            def countdown_game():
+                game = new_game()
+                game.render(game.engine.feed(13))
+                game.render(game.engine.feed(13))
+                game.render(game.engine.feed(13))
+                return game
+
+            def loop_tick(game):
+                # one countdown second: feed the engine, render and commit
+                for _ in range(50):
+                    game.engine.clock.now += game.engine.next_wakeup()
+                    game.render(game.engine.feed())
+                    game.commit()
+            benchmark(results, 'loop_tick', loop_tick, 50, countdown_game)
+
+            def alarm_game():
+                game = new_game()
+                game.alarm = Alarm(alarm_path, NullBackend())
+                return game
+
+            def alarm_latency(game):
+                # from the timeout frame to the backend starting the sound
+                backend = game.alarm.backend
+                for _ in range(100):
+                    backend.event.clear()
+                    game.render({'alarm'})
+                    backend.event.wait()
+                game.alarm.close()
+            benchmark(results, 'alarm_latency', alarm_latency, 100, alarm_game)
+
+            def turns(game):
+                # failed turns only, the board is left untouched; the
+                # intents are not kept, to measure the memory of the engine
+                driver = Driver(game.engine, keep=0)
+                for _ in range(1000):
+                    driver.play(['\r\r\r', 64, 'f', 3])
+            benchmark(results, 'engine_turn', turns, 1000, new_game)
+
+        for size in sizes:
+            path = os.path.join(tmp, 'deck_{}.csv'.format(size))
+            write_synthetic_deck(path, size)
+
+            def index_deck(state):
+                if os.path.exists(path + '.idx'):
+                    os.remove(path + '.idx')
+                CardStore(path)
+            benchmark(results, 'deck_index_{}'.format(size), index_deck, 1, repeat=1)
+            benchmark(results, 'deck_load_{}'.format(size), lambda state: Deck(CardStore(path), 1), 1)
+
+            def draw(deck):
+                for _ in range(10000):
+                    deck.draw()
+            benchmark(results, 'deck_draw_{}'.format(size), draw, 10000, lambda: Deck(CardStore(path), 1), repeat=1)
+
+        # draws skipping recent cards, with a played table of rows cards
+        # (unrelated to the deck but for the cards of one draw in two)
+        path = os.path.join(tmp, 'deck_{}.csv'.format(sizes[-1]))
+        for rows in [100000] + ([] if quick else [1000000]):
+            db = os.path.join(tmp, 'played_{}.db'.format(rows))
+            card_history = CardHistory(db)
+            with card_history.db:
+                card_history.db.executemany('INSERT INTO played VALUES (?, ?, 1)',
+                    ((random.getrandbits(63), time.time()) for _ in range(rows)))
+            deck = Deck(CardStore(path), 1)
+            for _ in range(20000):
+                card = deck.draw()
+                if random.random() < 0.5:
+                    card_history.record(card)
+
+            def history_draws(engine):
+                for _ in range(10000):
+                    engine.pick_card()
+            benchmark(results, 'card_history_draw_{}'.format(rows), history_draws, 10000,
+                lambda: Engine(categories, Deck(CardStore(path), 1), 2, card_history=card_history), repeat=1)
+            card_history.close()
+
+        # a draw and an outcome moving the card, on a deck of the largest size
+        def difficulty_draws(sampler):
+            for i in range(10000):
+                index = sampler.draw(i % 5)
+                sampler.update(index, i % 5, i % 3, i % 7)
+        benchmark(results, 'difficulty_draw_{}'.format(sizes[-1]), difficulty_draws, 10000,
+            lambda: DifficultySampler(range(sizes[-1]), 5, {}, 0.3, random.Random(1)), repeat=1)
+
+        for depth in depths:
+            path = os.path.join(tmp, 'history_{}.pickle'.format(depth))
+
+            def long_game():
+                engine = Engine(categories, Deck(cards, 1), 4, depth, clock=ManualClock(), seed=1)
+                for i in range(depth):
+                    engine.positions[i % 4] = i % len(engine.board_str)
+                    engine.card_data = cards[i % len(cards)]
+                    engine.history.push(engine.get_state())
+                return engine
+
+            def save(engine):
+                journal = Journal(path, 0)
+                journal.snapshot(engine.get_game())
+                journal.close()
+            benchmark(results, 'save_{}'.format(depth), save, 1, long_game)
+            benchmark(results, 'restore_{}'.format(depth), lambda state: Journal.load(path), 1)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+def measure_startup(cards, lines=40, cols=120):
+    # seconds to the first frame of a game launched on a pseudo-terminal, as
+    # reported by --startup-trace once the game is quit at its first frame
+    import pty
+    import fcntl
+    import termios
+    pid, fd = pty.fork()
+    if pid == 0:
+        fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack('HHHH', lines, cols, 0, 0))
+        # LINES and COLUMNS would override the size of the terminal
+        env = dict((name, value) for name, value in os.environ.items() if name not in ['LINES', 'COLUMNS'])
+        env['ESCDELAY'] = '25'
+        os.execve(sys.executable, [sys.executable, os.path.abspath(__file__),
+            '--startup-trace', '--audio', 'none', '--cards', cards], env)
+    output = b''
+    sent = []
+    try:
+        # ESC at the first frame, then N at the save prompt
+        while True:
+            if select.select([fd], [], [], 10)[0]:
+                data = os.read(fd, 65536)
+            else:
+                data = b''
+            if not data:
+                break
+            output += data
+            if not sent and Game.text_header.encode('utf-8') in output:
+                sent.append(os.write(fd, b'\x1b'))
+            elif len(sent) == 1 and Game.text_save_game.encode('utf-8') in output:
+                sent.append(os.write(fd, b'n'))
+    except OSError:
+        # the terminal is gone with the game
+        pass
+    finally:
+        os.close(fd)
+        os.waitpid(pid, 0)
+    for line in output.decode('utf-8', 'replace').splitlines():
+        if line.startswith('first frame'):
+            return float(line.split()[-2]) / 1e3
+    raise OSError(u'no first frame in the output of the game')
+
+def compare_benchmarks(results, baseline, threshold):
+    # operations slower or using more memory than the baseline by more than
+    # the threshold (a fraction)
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        if name not in results:
+            continue
+        for metric in ['time', 'peak']:
+            if base[metric] and results[name][metric] > base[metric] * (1 + threshold):
+                regressions.append(u'{} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, metric,
+                    base[metric], results[name][metric], results[name][metric] / base[metric] - 1))
+    return regressions
+
+def bench(args):
+    import json
+    results = {
+        'python': sys.version.split()[0],
+        'benchmarks': run_benchmarks(args.quick)}
+    try:
+        startup = measure_startup(args.startup_cards)
+    except OSError as e:
+        die(u'Unable to launch a game: {}\n'.format(e))
+    results['benchmarks']['startup'] = {'time': startup, 'peak': 0}
+    sys.stderr.write(u'{:<24s} {:12.3f} ms to the first frame\n'.format('startup', startup * 1e3))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                baseline = json.load(f)['benchmarks']
+        except (OSError, ValueError, KeyError):
+            die(u'Unable to load the baseline {}, aborting.\n'.format(args.compare))
+        regressions = compare_benchmarks(results['benchmarks'], baseline, args.threshold)
+        if regressions:
+            die(u'Regressions over {:.0%}:\n  {}\n'.format(args.threshold, u'\n  '.join(regressions)))
+        sys.stderr.write(u'No regression over {:.0%}\n'.format(args.threshold))
+    if startup > args.startup_budget:
+        die(u'Startup over budget: {:.0f} ms to the first frame, {:.0f} ms allowed\n'.format(
+            startup * 1e3, args.startup_budget * 1e3))
+
+class RemoteAlarm:
+    # alarm played by the client of a hosted game
+    def __init__(self):
+        self.pending = False
+
+    def play(self):
+        self.pending = True
+
+def parse_address(address):
+    # unix:PATH or HOST:PORT
+    if address.startswith('unix:'):
+        return address[len('unix:'):], None
+    host, _, port = address.rpartition(':')
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        die(u'Invalid address {}, use HOST:PORT or unix:PATH.\n'.format(address))
+
+def encode_message(message):
+    # messages are json objects, one per line
+    import json
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def send_message(writer, message):
+    writer.write(encode_message(message))
+
+def merge_delta(old, new):
+    # a delta replacing both, positions are merged team by team
+    merged = dict(old)
+    merged.update(new)
+    if 'positions' in old and 'positions' in new:
+        merged['positions'] = dict(old['positions'], **new['positions'])
+    merged['type'] = old['type']
+    return merged
+
+class Subscriber:
+    # spectator connection: at most one message is pending, a change coming
+    # while the connection is busy is merged into it, so that a slow spectator
+    # skips stale frames instead of queueing them
+    def __init__(self, writer):
+        import asyncio
+        self.writer = writer
+        self.pending = None
+        self.data = None
+        self.dropped = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def push(self, message, data=None):
+        if self.pending is None:
+            self.pending = message
+            self.data = data
+        else:
+            self.pending = merge_delta(self.pending, message)
+            self.data = None
+            self.dropped += 1
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            try:
+                if self.pending is not None:
+                    data = self.data or encode_message(self.pending)
+                    self.pending = self.data = None
+                    self.writer.write(data)
+                    await self.writer.drain()
+                if self.closed:
+                    send_message(self.writer, {'type': 'bye', 'text': u'Game over'})
+                    await self.writer.drain()
+                    return
+            except ConnectionError:
+                return
+
+class Broadcast:
+    # spectator feed of a game: a snapshot of the board when subscribing, then
+    # deltas of what changed (positions of the teams that moved, active team,
+    # all play, countdown ticks) encoded once for all the subscribers
+    def __init__(self, board, teams, timeout):
+        self.static = {'board': board, 'teams': teams, 'timeout': timeout}
+        self.state = {'positions': {}}
+        self.subscribers = set()
+
+    def subscribe(self, writer):
+        subscriber = Subscriber(writer)
+        # small buffers, so that a slow spectator is detected early
+        writer.transport.set_write_buffer_limits(high=16384)
+        subscriber.push(dict(self.state, type='snapshot', **self.static))
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def publish(self, state):
+        delta = {}
+        for name, value in state.items():
+            if name == 'positions':
+                moved = dict((team, position) for team, position in value.items()
+                    if self.state['positions'].get(team) != position)
+                if moved:
+                    delta[name] = moved
+            elif self.state.get(name) != value:
+                delta[name] = value
+        if not delta:
+            return
+        self.state = state
+        delta['type'] = 'delta'
+        data = encode_message(delta)
+        for subscriber in self.subscribers:
+            subscriber.push(delta, data)
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+def spectator_state(engine):
+    # team numbers as strings, as they come out of json
+    return {
+        'positions': dict((str(team), position) for team, position in enumerate(engine.positions)),
+        'active_team': engine.active_team,
+        'all_play': engine.all_play,
+        'countdown': engine.elapsed}
+
+class Session:
+    # a client connection: either a game hosted by the server and played by
+    # a thin client, or a spectator of one. The game runs on a VirtualWindow,
+    # and wakes up only for the client messages and the engine timers, so
+    # that an idle game costs nothing
+    hello_timeout = 10
+
+    def __init__(self, server, reader, writer):
+        import asyncio
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.messages = asyncio.Queue()
+        self.closed = False
+        self.screen = None
+        self.game = None
+        self.name = None
+        self.broadcast = None
+        self.alarm = RemoteAlarm()
+
+    async def read(self):
+        # client messages, None once the connection is closed
+        import json
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    await self.messages.put(json.loads(line))
+                except ValueError:
+                    break
+        except ConnectionError:
+            pass
+        await self.messages.put(None)
+
+    async def receive(self, timeout=None):
+        # next message, {} when timing out and None once disconnected
+        import asyncio
+        if self.closed:
+            return None
+        try:
+            message = await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.closed = message is None
+        return message
+
+    async def flush(self):
+        self.game.commit(force=True)
+        runs = self.screen.frame()
+        if runs:
+            send_message(self.writer, {'type': 'frame', 'runs': runs})
+        if self.alarm.pending:
+            self.alarm.pending = False
+            send_message(self.writer, {'type': 'alarm'})
+        self.broadcast.publish(spectator_state(self.game.engine))
+        await self.writer.drain()
+
+    async def bye(self, text):
+        send_message(self.writer, {'type': 'bye', 'text': text})
+        await self.writer.drain()
+
+    async def run(self):
+        import asyncio
+        reader = asyncio.ensure_future(self.read())
+        try:
+            hello = await self.receive(self.hello_timeout)
+            if hello and hello.get('type') == 'watch':
+                await self.watch(hello.get('game'))
+                return
+            if not hello or hello.get('type') != 'hello':
+                return
+            try:
+                self.start(hello)
+            except ValueError as e:
+                await self.bye(u'{}, aborting.'.format(e))
+                return
+            try:
+                await self.play()
+            except ScreenTooSmall as e:
+                await self.bye(u'Minimum term size {}x{}, aborting.'.format(e.cols, e.lines))
+            except GameTerminated as e:
+                if e.error:
+                    await self.bye(u'Unable to save the game as {}: {}'.format(self.name, e.error))
+                else:
+                    await self.bye(u'Game saved as {}'.format(self.name) if e.saved else u'')
+        except ConnectionError:
+            pass
+        finally:
+            reader.cancel()
+            if self.broadcast:
+                self.broadcast.close()
+                del self.server.games[self.name]
+            if self.game and self.game.journal.thread:
+                # disconnected mid game: keep it to be resumed
+                self.game.save_game()
+                await asyncio.get_event_loop().run_in_executor(None, self.game.journal.close)
+
+    def start(self, hello):
+        import pickle
+        server = self.server
+        teams = int(hello.get('teams', 2))
+        if teams > 4 or teams < 2:
+            raise ValueError(u'Number of teams must be between 2 and 4')
+        self.name = hello.get('game') or server.new_name()
+        if os.path.basename(self.name) != self.name or self.name.startswith('.'):
+            raise ValueError(u'Invalid game name {}'.format(self.name))
+        if self.name in server.games:
+            raise ValueError(u'Game {} is already being played'.format(self.name))
+        path = os.path.join(server.save_dir, self.name)
+        seed = hello.get('seed')
+        engine = Engine(server.categories, Deck(server.cards, seed), teams, server.undo_depth,
+            seed=seed, timeout=int(hello.get('timeout', 60)), card_history=server.card_history)
+        if os.path.exists(path):
+            try:
+                engine.load_game(Journal.load(path))
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+                raise ValueError(u'Unable to restore {}'.format(self.name))
+        self.screen = VirtualWindow(int(hello['lines']), int(hello['cols']))
+        self.game = Game(self.screen, engine, path, autosave_interval=server.autosave_interval, alarm=self.alarm)
+        self.broadcast = Broadcast(engine.board_str, [team.color for team in engine.teams], engine.timer.duration)
+        server.games[self.name] = self
+
+    async def watch(self, name):
+        import asyncio
+        session = self.server.games.get(name)
+        if session is None:
+            await self.bye(u'No game named {}'.format(name))
+            return
+        subscriber = session.broadcast.subscribe(self.writer)
+        feed = asyncio.ensure_future(subscriber.run())
+        disconnected = asyncio.ensure_future(self.receive())
+        try:
+            await asyncio.wait([feed, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            session.broadcast.subscribers.discard(subscriber)
+            feed.cancel()
+            disconnected.cancel()
+
+    async def play(self):
+        game = self.game
+        engine = game.engine
+        game.begin()
+        while True:
+            if not engine.effects:
+                game.journal_event()
+            await self.flush()
+            message = await self.receive(engine.next_wakeup())
+            if message is None:
+                return
+            kind = message.get('type')
+            if kind == 'key':
+                key = message['key']
+                game.render(engine.feed(key))
+                if key == 27:
+                    await self.save_prompt()
+            elif kind == 'interrupt':
+                engine.interrupt()
+                game.render(engine.feed())
+            elif kind == 'resize':
+                await self.resize(message['lines'], message['cols'])
+            else:
+                game.render(engine.feed())
+
+    async def save_prompt(self):
+        self.game.show_save_prompt()
+        while True:
+            await self.flush()
+            message = await self.receive()
+            if message is None:
+                return
+            key = message.get('key')
+            if key in [ord(x) for x in 'yYnN']:
+                self.game.quit(chr(key).upper() == 'Y')
+
+    async def resize(self, lines, cols):
+        # as Game.resize, waiting for the client to get big enough
+        game = self.game
+        running = game.engine.timer.running
+        game.engine.pause()
+        while True:
+            self.screen.resize(lines, cols)
+            if game._big_enough():
+                break
+            game.show_too_small()
+            await self.flush()
+            while True:
+                message = await self.receive()
+                if message is None:
+                    return
+                if message.get('type') == 'resize':
+                    lines, cols = message['lines'], message['cols']
+                    break
+        game.stdscr.erase()
+        if running:
+            game.engine.resume()
+        game.draw_interface()
+
+class Server:
+    # hosts many games in one process, one per client connection
+    backlog = 1024
+    def __init__(self, categories, cards, save_dir, undo_depth=100, autosave_interval=1, card_history=None):
+        self.categories = categories
+        self.cards = cards
+        self.save_dir = save_dir
+        self.undo_depth = undo_depth
+        self.autosave_interval = autosave_interval
+        self.card_history = card_history
+        self.sessions = set()
+        # games being played, by name
+        self.games = {}
+        self.count = 0
+
+    def new_name(self):
+        self.count += 1
+        return 'pyctionary_{}_{}.pickle'.format(time.strftime('%Y%m%d-%H%M%S'), self.count)
+
+    async def handle(self, reader, writer):
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def serve(self, address):
+        import asyncio
+        path, port = parse_address(address)
+        if port is None:
+            server = await asyncio.start_unix_server(self.handle, path, backlog=self.backlog)
+        else:
+            server = await asyncio.start_server(self.handle, path, port, backlog=self.backlog)
+        sys.stderr.write(u'Serving on {}\n'.format(address))
+        async with server:
+            await server.serve_forever()
+
+def serve(args, categories, cards):
+    import asyncio
+    server = Server(categories, cards, args.save_dir, args.undo_depth, args.autosave_interval,
+        open_card_history(args))
+    with virtual_curses():
+        try:
+            asyncio.run(server.serve(args.address))
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            die(u'Unable to listen on {}: {}\n'.format(args.address, e.strerror))
+
+def connect_socket(address):
+    import socket
+    path, port = parse_address(address)
+    if port is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection((path, port))
+    return sock
+
+def signal_pipe(signums):
+    # pipe receiving the number of each signal caught, for select to wake up
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w, warn_on_full_buffer=False)
+    for signum in signums:
+        signal.signal(signum, lambda signum, frame: None)
+    return wakeup_r
+
+def resize_terminal(stdscr):
+    cols, lines = os.get_terminal_size(sys.stdin.fileno())
+    curses.resizeterm(lines, cols)
+    stdscr.clear()
+    return lines, cols
+
+def client(stdscr, sock, hello, alarm):
+    # thin client: paints the frames of a hosted game and sends the keys.
+    # Signals (Ctrl-C, terminal resize) wake up the select through a pipe
+    import json
+    init_colors()
+    stdscr.nodelay(True)
+    wakeup_r = signal_pipe([signal.SIGINT, signal.SIGWINCH])
+    lines, cols = stdscr.getmaxyx()
+    hello.update(type='hello', lines=lines, cols=cols)
+    out = sock.makefile('wb')
+    received = b''
+
+    def send(message):
+        send_message(out, message)
+        out.flush()
+
+    send(hello)
+    while True:
+        readable = select.select([sock, sys.stdin, wakeup_r], [], [])[0]
+        if wakeup_r in readable:
+            for signum in os.read(wakeup_r, 64):
+                if signum == signal.SIGINT:
+                    send({'type': 'interrupt'})
+                elif signum == signal.SIGWINCH:
+                    lines, cols = resize_terminal(stdscr)
+                    send({'type': 'resize', 'lines': lines, 'cols': cols})
+        if sys.stdin in readable:
+            while True:
+                key = stdscr.getch()
+                if key == -1:
+                    break
+                if key != curses.KEY_RESIZE:
+                    send({'type': 'key', 'key': key})
+        if sock in readable:
+            data = sock.recv(65536)
+            if not data:
+                return u'Connection closed by the server'
+            *lines, received = (received + data).split(b'\n')
+            for line in lines:
+                message = json.loads(line)
+                if message['type'] == 'frame':
+                    for y, x, text, attr in message['runs']:
+                        try:
+                            stdscr.addstr(y, x, text, attr)
+                        except curses.error:
+                            # the bottom right cell, or a frame older than a resize
+                            pass
+                    stdscr.refresh()
+                elif message['type'] == 'alarm':
+                    alarm.play()
+                elif message['type'] == 'bye':
+                    return message['text']
+
+def connect(args):
+    try:
+        sock = connect_socket(args.address)
+    except OSError as e:
+        die(u'Unable to connect to {}: {}\n'.format(args.address, e.strerror))
+    hello = {'teams': args.teams, 'timeout': args.timeout, 'seed': args.seed, 'game': args.game}
+    alarm = Alarm(alarm_path, AplayBackend() if args.audio == 'aplay' else NullBackend())
+    try:
+        text = curses.wrapper(client, sock, hello, alarm)
+    except ConnectionError:
+        text = u'Connection lost'
+    finally:
+        alarm.close()
+        sock.close()
+    if text:
+        sys.stderr.write(text + u'\n')
+
+class BoardState:
+    # the part of an engine shown to spectators, kept up to date by the feed
+    def __init__(self, snapshot):
+        self.board_str = snapshot['board']
+        self.categories = []
+        self.teams = [Team(i, color) for i, color in enumerate(snapshot['teams'])]
+        self.num_teams = len(self.teams)
+        self.positions = [0] * self.num_teams
+        self.timer = Timer(snapshot['timeout'])
+        self.active_team = 0
+        self.all_play = False
+        self.elapsed = None
+        self.message = u''
+        self.answer = u''
+        self.update(snapshot)
+
+    def update(self, delta):
+        for team, position in delta.get('positions', {}).items():
+            self.positions[int(team)] = position
+        self.active_team = delta.get('active_team', self.active_team)
+        self.all_play = delta.get('all_play', self.all_play)
+        self.elapsed = delta.get('countdown', self.elapsed)
+        self.message = Engine.text_countdown if self.elapsed is not None else u''
+
+class Spectator(Game):
+    # read-only board of a hosted game, drawn from its spectator feed
+    fmt_header = u'Pyctionary, watching {}. ESC to quit'
+
+    def __init__(self, stdscr, name):
+        self.stdscr = stdscr
+        self.name = name
+        self.engine = None
+        self.y, self.x = [size - 1 for size in stdscr.getmaxyx()]
+        self.layout = None
+        self.windows = {}
+        self.tracks = {}
+        self.header = None
+        self.board = None
+        self.footer = None
+        self.frame_pending = False
+        self.traffic = None
+        self.interface_setup()
+
+    def apply(self, message):
+        if message['type'] == 'snapshot':
+            self.engine = BoardState(message)
+            self.redraw()
+        else:
+            self.engine.update(message)
+            if 'positions' in message or 'active_team' in message:
+                self.update_board()
+            self.update_footer()
+        self.commit()
+
+    def redraw(self):
+        self.stdscr.erase()
+        if not self._big_enough():
+            self.show_too_small()
+            return
+        if self.engine:
+            self.layout = self._layout()
+            self.draw_header()
+            self.draw_board()
+            self.draw_footer()
+            self.commit()
+
+    def draw_header(self):
+        self.place('header', self.layout.windows['header'])
+        self.header.bkgd(u' ', curses.color_pair(6) | curses.A_BOLD)
+        self.header.addstr(0, 1, self.fmt_header.format(self.name), curses.color_pair(6))
+
+    def draw_footer(self):
+        self.place('footer', (3, self.x, 1 + self.layout.board_lines, 0))
+        self.update_footer()
+
+    def _big_enough(self):
+        # only the board has to fit
+        self.y, self.x = self.stdscr.getmaxyx()
+        if self.x < Layout.min_cols:
+            return False
+        return not self.engine or self.y >= self._layout().board_lines + 5
+
+    def commit(self, force=False):
+        if not self.header or not self._big_enough():
+            return
+        self.stdscr.noutrefresh()
+        for surface in [self.header, self.board, self.footer]:
+            surface.noutrefresh()
+        curses.doupdate()
+
+def spectate(stdscr, sock, name):
+    import json
+    view = Spectator(stdscr, name)
+    stdscr.nodelay(True)
+    wakeup_r = signal_pipe([signal.SIGWINCH])
+    sock.sendall(encode_message({'type': 'watch', 'game': name}))
+    received = b''
+    while True:
+        readable = select.select([sock, sys.stdin, wakeup_r], [], [])[0]
+        if wakeup_r in readable:
+            os.read(wakeup_r, 64)
+            resize_terminal(stdscr)
+            view.redraw()
+        if sys.stdin in readable:
+            while True:
+                key = stdscr.getch()
+                if key == -1:
+                    break
+                if key in [27, ord('q'), ord('Q')]:
+                    return u''
+        if sock in readable:
+            data = sock.recv(65536)
+            if not data:
+                return u'Connection closed by the server'
+            *lines, received = (received + data).split(b'\n')
+            for line in lines:
+                message = json.loads(line)
+                if message['type'] == 'bye':
+                    return message['text']
+                view.apply(message)
+
+def watch(args):
+    try:
+        sock = connect_socket(args.address)
+    except OSError as e:
+        die(u'Unable to connect to {}: {}\n'.format(args.address, e.strerror))
+    try:
+        text = curses.wrapper(spectate, sock, args.game)
+    except ConnectionError:
+        text = u'Connection lost'
+    finally:
+        sock.close()
+    if text:
+        sys.stderr.write(text + u'\n')
+
+async def open_stream(address):
+    import asyncio
+    path, port = parse_address(address)
+    if port is None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(path, port)
+
+async def simulated_spectator(address, game, stats, delay):
+    # watches a game until it ends, reading slowly when delay is given
+    import asyncio
+    import json
+    await asyncio.sleep(1)
+    try:
+        reader, writer = await open_stream(address)
+    except OSError:
+        stats['errors'] += 1
+        return
+    send_message(writer, {'type': 'watch', 'game': game})
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            stats['spectator_messages'] += 1
+            stats['spectator_bytes'] += len(line)
+            if message['type'] == 'bye':
+                break
+            await asyncio.sleep(delay)
+    except OSError:
+        stats['errors'] += 1
+    finally:
+        writer.close()
+
+async def simulated_client(address, index, end, stats, pace):
+    # plays failed turns with random pauses scaled by pace, recording the
+    # delay between a key and the next frame (a key the game ignores waits
+    # for the next countdown tick)
+    import asyncio
+    import json
+    try:
+        reader, writer = await open_stream(address)
+    except OSError:
+        stats['errors'] += 1
+        return
+    rand = random.Random(index)
+    sent = []
+
+    async def receive():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            stats['bytes'] += len(line)
+            if message['type'] == 'frame':
+                stats['frames'] += 1
+                if sent:
+                    stats['latency'].add(time.monotonic() - sent.pop())
+                    sent.clear()
+            elif message['type'] == 'bye':
+                return
+
+    receiver = asyncio.ensure_future(receive())
+    send_message(writer, {'type': 'hello', 'lines': 40, 'cols': 120, 'teams': 2, 'seed': index,
+        'game': 'loadtest_{}'.format(index)})
+    stats['clients'] += 1
+    script = [13, 13, 13, 'interrupt', ord('f')]
+    try:
+        while time.monotonic() < end and not receiver.done():
+            for key in script:
+                await asyncio.sleep(pace * (rand.uniform(0.5, 3) if key != 'interrupt' else rand.uniform(5, 30)))
+                if key == 'interrupt':
+                    send_message(writer, {'type': 'interrupt'})
+                else:
+                    send_message(writer, {'type': 'key', 'key': key})
+                sent.append(time.monotonic())
+                stats['keys'] += 1
+                await writer.drain()
+        # quit without saving
+        for key in [27, ord('n')]:
+            send_message(writer, {'type': 'key', 'key': key})
+        await writer.drain()
+        await asyncio.wait_for(receiver, 10)
+    except (OSError, asyncio.TimeoutError):
+        stats['errors'] += 1
+    finally:
+        receiver.cancel()
+        writer.close()
+
+async def run_load_test(address, clients, duration, pace, spectators=0, spectator_delay=0):
+    import asyncio
+    stats = {'clients': 0, 'errors': 0, 'keys': 0, 'frames': 0, 'bytes': 0, 'latency': Histogram(),
+        'spectator_messages': 0, 'spectator_bytes': 0}
+    end = time.monotonic() + duration
+    await asyncio.gather(*[simulated_client(address, i, end, stats, pace) for i in range(clients)]
+        + [simulated_spectator(address, 'loadtest_{}'.format(i % clients), stats, spectator_delay)
+            for i in range(spectators)])
+    return stats
+
+def load_test(args):
+    import asyncio
+    start = time.monotonic()
+    stats = asyncio.run(run_load_test(args.address, args.clients, args.duration, args.pace,
+        args.spectators, args.spectator_delay))
+    elapsed = time.monotonic() - start
+    sys.stderr.write(u'{} clients connected, {} errors, {} keys, {} frames, {} bytes in {:.1f}s\n'.format(
+        stats['clients'], stats['errors'], stats['keys'], stats['frames'], stats['bytes'], elapsed))
+    if args.spectators:
+        sys.stderr.write(u'{} spectators, {} messages, {} bytes\n'.format(
+            args.spectators, stats['spectator_messages'], stats['spectator_bytes']))
+    if stats['latency'].count:
+        sys.stderr.write(stats['latency'].summary(u'key to frame') + u'\n')
+
+def simulate_batch(board_str, num_teams, success, games, seed, max_turns):
+    # plays games in lockstep with numpy arrays, following the engine rules:
+    # a team keeps playing as long as it guesses, landing on an uppercase
+    # cell makes the next card an all play won by one of the teams guessing
+    # it, the dice go 1-6 and the first team reaching the last cell wins
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    last = len(board_str) - 1
+    # probability of guessing on every cell, on white cells the team picks
+    # the easiest category
+    cell_success = np.array([max(success) if c == '*' else success['ybmgr'.index(c.lower())]
+        for c in board_str])
+    all_play_cell = np.array([c.isupper() for c in board_str])
+
+    positions = np.zeros((games, num_teams), dtype=np.int64)
+    start = rng.integers(0, num_teams, games)
+    active = start.copy()
+    all_play = np.zeros(games, dtype=bool)
+    turns = np.zeros(games, dtype=np.int64)
+    all_plays = np.zeros(games, dtype=np.int64)
+    winner = np.full(games, -1)
+    playing = np.ones(games, dtype=bool)
+
+    for _ in range(max_turns):
+        idx = np.flatnonzero(playing)
+        if not idx.size:
+            break
+        team = active[idx]
+        chance = cell_success[positions[idx, team]]
+        everyone = all_play[idx]
+        turns[idx] += 1
+        all_plays[idx] += everyone
+
+        # the active team guesses or passes the turn
+        mover = np.where(rng.random(idx.size) < chance, team, -1)
+        if everyone.any():
+            # all play: pick one of the teams guessing the card, if any
+            hits = rng.random((everyone.sum(), num_teams)) < chance[everyone, None]
+            scores = np.where(hits, rng.random(hits.shape), -1)
+            mover[everyone] = np.where(hits.any(axis=1), scores.argmax(axis=1), -1)
+        all_play[idx] = False
+
+        failed = mover < 0
+        active[idx[failed]] = (team[failed] + 1) % num_teams
+
+        moving = idx[~failed]
+        who = mover[~failed]
+        active[moving] = who
+        old = positions[moving, who]
+        new = np.minimum(old + rng.integers(1, 7, moving.size), last)
+        positions[moving, who] = new
+        all_play[moving] = all_play_cell[new] & (new != old)
+        finished = new == last
+        winner[moving[finished]] = who[finished]
+        playing[moving[finished]] = False
+
+    done = winner >= 0
+    return {
+        'lengths': np.bincount(turns[done], minlength=max_turns + 1),
+        'unfinished': int((~done).sum()),
+        'start_wins': int((winner == start).sum()),
+        'turns': int(turns.sum()),
+        'all_play_turns': int(all_plays.sum()),
+        'all_play_games': int((all_plays > 0).sum())}
+
+def simulate(args):
+    import json
+    try:
+        import numpy as np
+    except ImportError:
+        die(u'The simulator requires numpy, aborting.\n')
+    import concurrent.futures
+
+    board_str = args.board or Engine.board_str
+    if not board_str or any(c not in 'ybmgrYBMGR*' for c in board_str):
+        die(u'Board cells must be one of ybmgr (uppercase for all play) or *.\n')
+    if len(args.success) != 5 or any(not 0 <= p <= 1 for p in args.success):
+        die(u'Five success probabilities between 0 and 1 are required.\n')
+    if args.teams > 4 or args.teams < 2:
+        die(u'Number of teams must be between 2 and 4.\n')
+    if args.games < 1:
+        die(u'Number of games must be at least 1.\n')
+    if args.batch_size < 1:
+        die(u'Batch size must be at least 1.\n')
+    if args.max_turns < 1:
+        die(u'Maximum number of turns must be at least 1.\n')
+    if args.workers is not None and args.workers < 1:
+        die(u'Number of workers must be at least 1.\n')
+
+    # batches are fixed by the batch size and seeded from the main seed, so
+    # results only depend on the seed, not on the number of workers
+    sizes = [min(args.batch_size, args.games - i) for i in range(0, args.games, args.batch_size)]
+    seeds = np.random.SeedSequence(args.seed).spawn(len(sizes))
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        results = list(pool.map(simulate_batch, [board_str] * len(sizes), [args.teams] * len(sizes),
+            [args.success] * len(sizes), sizes, seeds, [args.max_turns] * len(sizes)))
+
+    lengths = sum(result['lengths'] for result in results)
+    totals = dict((name, sum(result[name] for result in results))
+        for name in ['unfinished', 'start_wins', 'turns', 'all_play_turns', 'all_play_games'])
+    finished = int(lengths.sum())
+    cumulative = np.cumsum(lengths)
+    percentile = lambda q: int(np.searchsorted(cumulative, q * finished)) if finished else 0
+    report = {
+        'games': args.games,
+        'unfinished': totals['unfinished'],
+        'length_mean': float((lengths * np.arange(lengths.size)).sum() / max(finished, 1)),
+        'length_percentiles': dict((str(q), percentile(q / 100)) for q in [1, 10, 50, 90, 99]),
+        'length_histogram': dict((str(i), int(n)) for i, n in enumerate(lengths) if n),
+        'all_play_per_game': totals['all_play_turns'] / args.games,
+        'all_play_turn_share': totals['all_play_turns'] / max(totals['turns'], 1),
+        'all_play_game_share': totals['all_play_games'] / args.games,
+        'start_win_rate': totals['start_wins'] / max(finished, 1),
+        'fair_win_rate': 1 / args.teams}
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write(u'\n')
+        return
+    p = report['length_percentiles']
+    sys.stdout.write(u'Games: {} ({} unfinished after {} turns)\n'.format(
+        args.games, report['unfinished'], args.max_turns))
+    sys.stdout.write(u'Game length (turns): mean {:.1f}, p1 {}, p10 {}, median {}, p90 {}, p99 {}\n'.format(
+        report['length_mean'], p['1'], p['10'], p['50'], p['90'], p['99']))
+    sys.stdout.write(u'All play: {:.2f} per game, {:.1%} of turns, {:.1%} of games\n'.format(
+        report['all_play_per_game'], report['all_play_turn_share'], report['all_play_game_share']))
+    sys.stdout.write(u'Starting team wins {:.2%} of games ({:+.2%} over a fair {:.2%})\n'.format(
+        report['start_win_rate'], report['start_win_rate'] - report['fair_win_rate'], report['fair_win_rate']))
+
+def game_checkpoints(game):
+    # checkpoints of a saved game from the oldest kept, and whether older
+    # ones fell off the undo history
+    if 'history' not in game:
+        # older saves store every checkpoint in full
+        return [Checkpoint(state[0], tuple(state[1]), *state[2:]) for state in game['states']], False
+    history = game['history']
+    if history.current is None:
+        return [], False
+    checkpoints = [history.current]
+    for delta in reversed(history.undo):
+        checkpoints.append(History._apply(checkpoints[-1], delta))
+    checkpoints.reverse()
+    return checkpoints, len(history.undo) == history.undo.maxlen
+
+class SavedCards:
+    # stands in for the deck and the cards of a save when only the game is
+    # looked at: the card file is neither opened nor shuffled
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def seek(self, shuffles, pos):
+        self.shuffles = shuffles
+        self.pos = pos
+
+def analyze_save(path):
+    # runs in a worker process, so anything a damaged file raises is reported
+    # back instead of taking the pool down
+    try:
+        return replay_save(path)
+    except Exception as e:
+        return {'path': path, 'error': u'{}: {}'.format(type(e).__name__, e)}
+
+def replay_save(path):
+    # replay the checkpoints of a save into the figures of its game
+    game = Journal.load(path, dict.fromkeys(['Deck', 'CardStore', 'CompiledDeck'], SavedCards))
+    checkpoints, truncated = game_checkpoints(game)
+    categories = game['categories']
+    teams = [team.color[0] if isinstance(team.color, tuple) else team.color for team in game['teams']]
+    board_str = Engine.board_str
+    turns = []
+    progress = []
+    for i, checkpoint in enumerate(checkpoints):
+        if checkpoint.state != State.check:
+            continue
+        progress.append(list(checkpoint.positions))
+        cell = board_str[min(checkpoint.positions[checkpoint.active_team], len(board_str)-1)]
+        category = Engine.category_of(cell, len(categories))
+        turn = {
+            'team': checkpoint.active_team,
+            'category': u'*' if category is None else categories[category],
+            'all_play': checkpoint.all_play,
+            # the checkpoint that follows tells whether the card was guessed,
+            # the last turn of a save may still be waiting for it
+            'winner': None,
+            'success': None}
+        if i + 1 < len(checkpoints):
+            following = checkpoints[i+1]
+            turn['success'] = following.state == State.roll
+            if turn['success']:
+                turn['winner'] = following.active_team
+        turns.append(turn)
+    positions = list(checkpoints[-1].positions) if checkpoints else list(game['positions'])
+    progress.append(positions)
+    finished = [team for team, position in enumerate(positions) if position >= len(board_str)-1]
+    return {
+        'path': path,
+        'teams': teams,
+        'truncated': truncated,
+        'first_team': checkpoints[0].active_team if checkpoints and not truncated else None,
+        'winner': finished[0] if finished else None,
+        'turns': turns,
+        'progress': progress}
+
+def save_paths(paths):
+    # saves given one by one or as directories of them
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                # skip hidden files and saves being replaced
+                if not name.startswith('.') and not name.endswith('.tmp') \
+                and os.path.isfile(os.path.join(path, name)):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def summarize_games(games):
+    categories = {}
+    all_play = {'turns': 0, 'drawing_team': 0, 'other_team': 0, 'no_team': 0}
+    turns = [len(game['turns']) for game in games]
+    for game in games:
+        for turn in game['turns']:
+            stats = categories.setdefault(turn['category'], {'turns': 0, 'successes': 0, 'failures': 0})
+            stats['turns'] += 1
+            if turn['success'] is not None:
+                stats['successes' if turn['success'] else 'failures'] += 1
+            if turn['all_play'] and turn['success'] is not None:
+                all_play['turns'] += 1
+                if not turn['success']:
+                    all_play['no_team'] += 1
+                elif turn['winner'] == turn['team']:
+                    all_play['drawing_team'] += 1
+                else:
+                    all_play['other_team'] += 1
+    finished = [game for game in games if game['winner'] is not None]
+    known_start = [game for game in finished if game['first_team'] is not None]
+    return {
+        'games': len(games),
+        'finished': len(finished),
+        'truncated': sum(game['truncated'] for game in games),
+        'turns_total': sum(turns),
+        'turns_mean': sum(turns) / max(len(games), 1),
+        'turns_max': max(turns, default=0),
+        'categories': categories,
+        'all_play': all_play,
+        'start_win_rate': sum(game['winner'] == game['first_team'] for game in known_start) / len(known_start)
+            if known_start else None}
+
+def write_analysis_csv(directory, games):
+    import csv
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'games.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'teams', 'turns', 'first_team', 'winner', 'truncated'])
+        for game in games:
+            writer.writerow([game['path'], len(game['teams']), len(game['turns']),
+                game['first_team'], game['winner'], int(game['truncated'])])
+    with open(os.path.join(directory, 'turns.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'turn', 'team', 'category', 'all_play', 'success', 'winner'])
+        for game in games:
+            for i, turn in enumerate(game['turns']):
+                writer.writerow([game['path'], i, turn['team'], turn['category'], int(turn['all_play']),
+                    u'' if turn['success'] is None else int(turn['success']), turn['winner']])
+    with open(os.path.join(directory, 'progress.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'turn', 'team', 'color', 'position'])
+        for game in games:
+            for i, positions in enumerate(game['progress']):
+                for team, position in enumerate(positions):
+                    writer.writerow([game['path'], i, team, game['teams'][team], position])
+
+def analyze(args):
+    import json
+    import concurrent.futures
+
+    paths = list(save_paths(args.saves))
+    if not paths:
+        die(u'No saved games found.\n')
+    workers = args.workers or os.cpu_count() or 1
+    games = []
+    skipped = []
+    # saves are small, hand them to the workers in chunks rather than one by one
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for result in pool.map(analyze_save, paths, chunksize=max(1, min(256, len(paths) // (4 * workers)))):
+            (skipped if 'error' in result else games).append(result)
+    for result in skipped:
+        sys.stderr.write(u'Skipped {}: {}\n'.format(result['path'], result['error']))
+
+    summary = summarize_games(games)
+    summary['skipped'] = len(skipped)
+    if args.csv:
+        write_analysis_csv(args.csv, games)
+    if args.json:
+        json.dump({'summary': summary, 'games': games}, sys.stdout, indent=2)
+        sys.stdout.write(u'\n')
+        return
+    sys.stdout.write(u'Games: {} ({} finished, {} with early turns beyond the undo history, {} skipped)\n'.format(
+        summary['games'], summary['finished'], summary['truncated'], summary['skipped']))
+    sys.stdout.write(u'Turns: {} in total, {:.1f} per game, at most {}\n'.format(
+        summary['turns_total'], summary['turns_mean'], summary['turns_max']))
+    for name, stats in sorted(summary['categories'].items(), key=lambda item: -item[1]['turns']):
+        played = stats['successes'] + stats['failures']
+        sys.stdout.write(u'Category {}: {} turns, {:.1%} guessed\n'.format(
+            name, stats['turns'], stats['successes'] / played if played else 0))
+    all_play = summary['all_play']
+    if all_play['turns']:
+        sys.stdout.write(u'All play: {} turns, won by the drawing team {:.1%}, by another team {:.1%}, by no team {:.1%}\n'.format(
+            all_play['turns'], all_play['drawing_team'] / all_play['turns'],
+            all_play['other_team'] / all_play['turns'], all_play['no_team'] / all_play['turns']))
+    if summary['start_win_rate'] is not None:
+        sys.stdout.write(u'Starting team wins {:.2%} of the finished games\n'.format(summary['start_win_rate']))
+    if args.csv:
+        sys.stdout.write(u'Tables written to {}\n'.format(args.csv))
+
 def die(msg):
     sys.stderr.write(msg)
     sys.stderr.flush()
     sys.exit(1)
 
-def start_game(stdscr, categories, cards, num_teams, restore, restore_file):
-    game = Game(stdscr, categories, cards, num_teams, restore_file)
-    if restore:
-        game.restore_game(restore)
-    signal.signal(signal.SIGINT, signal_handler)
-    game.loop()
+def start_game(stdscr, engine, restore_file, traffic, autosave_interval, profiler, alarm, trace):
+    trace.mark('curses')
+    game = Game(stdscr, engine, restore_file, traffic, autosave_interval, profiler, alarm, trace)
+    # Ctrl-C stops the countdown
+    signal.signal(signal.SIGINT, lambda signum, frame: engine.interrupt())
+    if profiler:
+        profiler.run(game.loop)
+    else:
+        game.loop()
 
 def main():
+    trace = StartupTrace()
+    trace.mark('imports')
     args = parse_arguments()
+    trace.mark('arguments')
+
+    if args.command == 'compile-deck':
+        compile_deck(args.csv, args.output)
+        return
+    if args.command == 'deck':
+        merge_decks(args.csv, args.output, args.max_errors)
+        return
+    if args.command == 'simulate':
+        simulate(args)
+        return
+    if args.command == 'analyze':
+        analyze(args)
+        return
+    if args.command == 'bench':
+        bench(args)
+        return
+    if args.command == 'loadtest':
+        load_test(args)
+        return
+    if args.command == 'watch':
+        watch(args)
+        return
 
     if args.teams > 4 or args.teams < 2:
         die(u'Number of teams must be between 2 and 4.\n')
-
-    restore_file = '/tmp/pyctionary_{}.pickle'.format(
-        datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
-
-    cards = load_cards(args.cards)
-    categories = cards[0]
-    cards = cards[1:]
+    if args.timeout < 1:
+        die(u'Timeout must be at least 1 second.\n')
+    if args.undo_depth < 1:
+        die(u'Undo depth must be at least 1.\n')
+    if args.difficulty is not None and not 0 <= args.difficulty <= 1:
+        die(u'Difficulty must be between 0 and 1.\n')
+    if args.difficulty is not None and not args.card_history:
+        die(u'Difficulty needs the outcomes of a card history (--card-history).\n')
+    if args.autosave_interval < 0:
+        die(u'Autosave interval must not be negative.\n')
+    if args.max_fps < 1:
+        die(u'Maximum frame rate must be at least 1.\n')
+
+    if args.command == 'connect':
+        connect(args)
+        return
+
+    restore_file = '/tmp/pyctionary_{}.pickle'.format(time.strftime('%Y%m%d-%H%M%S'))
+
+    categories, cards = load_cards(args.cards)
+    if args.command == 'serve':
+        serve(args, categories, cards)
+        return
+    trace.mark('cards')
+    # the first frame needs no card, the deck is shuffled meanwhile
+    deck = Deck(cards, args.seed, background=True)
+    engine = Engine(categories, deck, args.teams, args.undo_depth, seed=args.seed, timeout=args.timeout,
+        card_history=open_card_history(args), difficulty=args.difficulty)
+    trace.mark('engine')
+
+    if args.restore:
+        import pickle
+        try:
+            engine.load_game(Journal.load(args.restore))
+        except OSError as e:
+            die(u'Unable to restore {}: {}\n'.format(e.filename or args.restore, e.strerror))
+        except (EOFError, ValueError, pickle.UnpicklingError):
+            die(u'Malformed restore file provided, aborting\n')
+        trace.mark('restore')
+
+    traffic = Traffic(args.max_fps) if args.remote else None
+    profiler = Profiler(args.profile) if args.profile else None
+    alarm = Alarm(alarm_path, AplayBackend() if args.audio == 'aplay' else NullBackend())
 
     try:
-        curses.wrapper(start_game, categories, cards, args.teams, 
-            args.restore, restore_file)
+        curses.wrapper(start_game, engine, restore_file, traffic, args.autosave_interval, profiler, alarm, trace)
     except ScreenTooSmall as e:
         if e.saved:
             sys.stderr.write(u'Game saved as {}\n'.format(restore_file))
-        die(u'Minimum term size 104x32, aborting.\n')
+        elif e.error:
+            sys.stderr.write(u'Unable to save the game as {}: {}\n'.format(restore_file, e.error))
+        die(u'Minimum term size {}x{}, aborting.\n'.format(e.cols, e.lines))
     except GameTerminated as e:
         if e.saved:
             sys.stderr.write(u'Game saved as {}\n'.format(restore_file))
-    except pickle.UnpicklingError:
-        sys.stderr.write(u'Malformed restore file provided, aborting\n')
+        elif e.error:
+            die(u'Unable to save the game as {}: {}\n'.format(restore_file, e.error))
+    finally:
+        alarm.close()
+        if alarm.error:
+            sys.stderr.write(u'Alarm disabled: {}\n'.format(alarm.error))
+        if engine.invalid_cards:
+            sys.stderr.write(u'Skipped {} cards not matching the categories of {}, check it with the deck command.\n'.format(
+                len(engine.invalid_cards), args.cards))
+        if traffic:
+            sys.stderr.write(traffic.summary())
+        if profiler:
+            sys.stderr.write(profiler.dump())
+        if args.startup_trace:
+            sys.stderr.write(trace.summary())
 
 
 if __name__ == '__main__':
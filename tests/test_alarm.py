@@ -0,0 +1,73 @@
+import threading
+import time
+
+from pyctionary import Alarm, Deck, Driver, Engine, Game, ManualClock, NullBackend, alarm_path, virtual_curses
+
+
+class SlowBackend(NullBackend):
+    # a sound card taking its time: play returns once released
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def play(self, sound):
+        super().play(sound)
+        self.release.wait(5)
+
+
+def timeout_game(alarm, screen):
+    categories = [u'oggetto', u'persona', u'azione', u'difficile', u'miscellanea']
+    cards = [[u'{} {}'.format(category, i) for category in categories] for i in range(20)]
+    engine = Engine(categories, Deck(cards, 1), 2, clock=ManualClock(), seed=1, timeout=60)
+    game = Game(screen, engine, None, alarm=alarm)
+    game.check_size()
+    game.draw_interface()
+    driver = Driver(engine)
+    driver.start()
+    driver.play(['\n\n\n', 60])
+    return game, driver
+
+
+def test_timeout_plays_alarm_without_blocking():
+    backend = SlowBackend()
+    alarm = Alarm(alarm_path, backend)
+    with virtual_curses() as screen:
+        game, driver = timeout_game(alarm, screen)
+        intents = set().union(*driver.intents)
+        assert 'alarm' in intents
+        start = time.perf_counter()
+        game.render(intents)
+        assert backend.event.wait(5)
+        # the backend is still playing, the frame was not held back by it
+        assert time.perf_counter() - start < 5
+        game.render({'alarm'})
+        assert len(backend.played) == 1
+        backend.release.set()
+        alarm.close()
+    assert len(backend.played) == 2
+    assert alarm.error is None
+
+
+def test_render_returns_before_play():
+    backend = SlowBackend()
+    alarm = Alarm(alarm_path, backend)
+    with virtual_curses() as screen:
+        game, driver = timeout_game(alarm, screen)
+        game.render({'alarm'})
+        assert backend.event.wait(5)
+        start = time.perf_counter()
+        for _ in range(10):
+            game.render({'alarm'})
+        assert time.perf_counter() - start < 0.1
+        backend.release.set()
+        alarm.close()
+    assert len(backend.played) == 11
+
+
+def test_missing_sound_is_reported():
+    alarm = Alarm('/nonexistent/alarm.wav', NullBackend())
+    alarm.thread.join()
+    alarm.play()
+    alarm.close()
+    assert alarm.backend.played == []
+    assert 'unable to load /nonexistent/alarm.wav' in alarm.error
@@ -0,0 +1,70 @@
+import os
+import pickle
+
+from pyctionary import CardStore, CompiledDeck, Deck, Engine
+
+
+def write_cards(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(u''.join(row + u'\n' for row in rows))
+
+
+def test_saved_deck_restores_from_another_directory(tmp_path, monkeypatch):
+    write_cards(str(tmp_path / 'cards.csv'), [u'a,b', u'c,d', u'e,f'])
+    CompiledDeck.compile(CardStore(str(tmp_path / 'cards.csv')), str(tmp_path / 'cards.deck'))
+    monkeypatch.chdir(tmp_path)
+    saved = [pickle.dumps(Deck(cls(name), seed=1)) for cls, name in
+        [(CardStore, 'cards.csv'), (CompiledDeck, 'cards.deck')]]
+    os.mkdir('elsewhere')
+    monkeypatch.chdir('elsewhere')
+    for data in saved:
+        deck = pickle.loads(data)
+        assert deck.cards.categories == [u'a', u'b']
+        assert sorted(deck.draw() for _ in range(2)) == [[u'c', u'd'], [u'e', u'f']]
+
+
+def test_compiled_deck_matches_csv(tmp_path):
+    path = str(tmp_path / 'cards.csv')
+    write_cards(path, [
+        u'oggetto,persona,"azione, verbo"',
+        u'città,"Niccolò ""il Magnifico""",sbadigliare',
+        u'',
+        u'"tavolo\nda cucina",perù,"correre,\nsaltare"',
+        u'città,naïve,日本',
+        u'rasoio,studente,beccare'])
+    csv = CardStore(path)
+    CompiledDeck.compile(csv, str(tmp_path / 'cards.deck'))
+    compiled = CompiledDeck(str(tmp_path / 'cards.deck'))
+    assert compiled.categories == csv.categories == [u'oggetto', u'persona', u'azione, verbo']
+    assert len(compiled) == len(csv) == 4
+    rows = [csv[i] for i in range(len(csv))]
+    assert rows[0] == [u'città', u'Niccolò "il Magnifico"', u'sbadigliare']
+    assert rows[1] == [u'tavolo\nda cucina', u'perù', u'correre,\nsaltare']
+    assert [compiled[i] for i in range(len(compiled))] == rows
+    # same seed, same draws, across reshuffles
+    decks = [Deck(csv, seed=7), Deck(compiled, seed=7)]
+    assert [decks[0].draw() for _ in range(10)] == [decks[1].draw() for _ in range(10)]
+
+
+def test_short_rows_are_skipped(tmp_path):
+    path = str(tmp_path / 'cards.csv')
+    write_cards(path, [u'a,b,c,d,e', u'1,2,3,4,5', u'6,7', u'8,9,10,11,12', u'13,14,15,16,17,18'])
+    cards = CardStore(path)
+    engine = Engine(cards.categories, Deck(cards, seed=3), 2, seed=3)
+    picked = []
+    for _ in range(6):
+        engine.pick_card()
+        picked.append(engine.card_data)
+    assert all(len(card) == 5 for card in picked)
+    assert {u'1', u'8'} == set(card[0] for card in picked)
+    assert engine.invalid_cards == {(u'6', u'7'), (u'13', u'14', u'15', u'16', u'17', u'18')}
+
+
+def test_deck_without_valid_rows_is_padded(tmp_path):
+    path = str(tmp_path / 'cards.csv')
+    write_cards(path, [u'a,b,c', u'1,2', u'3'])
+    cards = CardStore(path)
+    engine = Engine(cards.categories, Deck(cards, seed=3), 2, seed=3)
+    engine.pick_card()
+    assert len(engine.card_data) == 3
+    assert len(engine.invalid_cards) == 2
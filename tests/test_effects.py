@@ -0,0 +1,103 @@
+import time
+
+from pyctionary import Deck, Driver, Engine, ManualClock, State
+
+# wall clock budget for a key to be answered while an effect is playing
+latency_budget = 0.05
+
+
+def make_engine(seed=1):
+    categories = [u'oggetto', u'persona', u'azione', u'difficile', u'miscellanea']
+    cards = [[u'{} {}'.format(category, i) for category in categories] for i in range(20)]
+    engine = Engine(categories, Deck(cards, seed), 2, clock=ManualClock(), seed=seed, timeout=60)
+    driver = Driver(engine)
+    driver.start()
+    return engine, driver
+
+
+def timed_key(driver, key):
+    # seconds of wall clock and of game clock spent answering a key
+    now = driver.clock.now
+    start = time.perf_counter()
+    driver.key(key)
+    return time.perf_counter() - start, driver.clock.now - now
+
+
+def to_check(engine, driver):
+    # pick a card, draw and stop the countdown
+    driver.play(['\n\n\n'])
+    assert engine.state == State.countdown
+    engine.interrupt()
+    driver.key(-1)
+    assert engine.state == State.check
+
+
+def to_roll(engine, driver):
+    to_check(engine, driver)
+    driver.play(['s', 2])
+    assert engine.state == State.roll
+
+
+def test_key_skips_banner():
+    engine, driver = make_engine()
+    to_check(engine, driver)
+    team = engine.active_team
+    driver.key('s')
+    assert engine.effects
+    assert engine.state == State.check
+    # the key only ends the banner, it is not read as an answer
+    latency, waited = timed_key(driver, 'f')
+    assert latency < latency_budget
+    assert waited == 0
+    assert not engine.effects
+    assert engine.state == State.roll
+    assert engine.active_team == team
+    assert engine.message == Engine.text_dice
+    assert engine.next_wakeup() is None
+
+
+def test_key_skips_dice():
+    engine, driver = make_engine()
+    to_roll(engine, driver)
+    team = engine.active_team
+    driver.key('0')
+    assert len(engine.effects) == 3
+    assert engine.next_wakeup() is not None
+    latency, waited = timed_key(driver, ' ')
+    assert latency < latency_budget
+    assert waited == 0
+    # the dice roll leaves its result and the team moves right away
+    assert not engine.effects
+    assert 1 <= engine.dice <= 6
+    assert engine.positions[team] == engine.dice
+    assert engine.state == State.pick
+    assert engine.message == Engine.text_pick_card
+    assert engine.next_wakeup() is None
+
+
+def test_dice_play_out_without_keys():
+    engine, driver = make_engine()
+    to_roll(engine, driver)
+    team = engine.active_team
+    driver.key('0')
+    # at most 7 seconds of dice, 1 to move and 2 of pause
+    driver.wait(10)
+    assert not engine.effects
+    assert engine.positions[team] == engine.dice
+    assert engine.state == State.pick
+
+
+def test_key_skips_timeout():
+    engine, driver = make_engine()
+    driver.play(['\n\n\n'])
+    driver.wait(60)
+    assert 'alarm' in set().union(*driver.intents)
+    assert engine.effects
+    assert engine.message == Engine.text_timeout
+    latency, waited = timed_key(driver, 's')
+    assert latency < latency_budget
+    assert waited == 0
+    assert not engine.effects
+    assert engine.state == State.check
+    assert engine.message == Engine.text_success_or_fail
+    assert engine.next_wakeup() is None
@@ -0,0 +1,78 @@
+import tracemalloc
+
+from pyctionary import Checkpoint, History, State
+
+depth = 100
+
+
+def checkpoints(count):
+    # a turn of every team in turn: pick, check and roll
+    positions = [0, 0, 0]
+    for turn in range(count):
+        team = turn % len(positions)
+        card = [u'{} {}'.format(category, turn) for category in u'abcde']
+        yield Checkpoint(team, tuple(positions), card, False, State.pick)
+        yield Checkpoint(team, tuple(positions), card, False, State.check)
+        positions[team] += 1
+        yield Checkpoint(team, tuple(positions), card, False, State.roll)
+
+
+def traced(history, pushed):
+    for checkpoint in pushed:
+        history.push(checkpoint)
+        # taken by the journal after every transition
+        history.ops = []
+    return tracemalloc.get_traced_memory()[0]
+
+
+def test_memory_bounded_by_depth():
+    tracemalloc.start()
+    try:
+        history = History(depth)
+        pushed = checkpoints(50 * depth)
+        start = tracemalloc.get_traced_memory()[0]
+        # well past the depth, so that older checkpoints are dropped
+        full = traced(history, (next(pushed) for _ in range(10 * depth)))
+        longer = traced(history, pushed)
+    finally:
+        tracemalloc.stop()
+    assert len(history) == depth + 1
+    # playing 5 times as many turns keeps the same memory
+    assert longer - start < (full - start) * 1.05
+    # a few hundred bytes per turn kept, cards included
+    assert (longer - start) / depth < 1024
+
+
+def test_undo_redo_replay_checkpoints():
+    history = History(depth)
+    pushed = list(checkpoints(depth))
+    for checkpoint in pushed:
+        history.push(checkpoint)
+    kept = pushed[-depth-1:]
+    undone = []
+    while history.undo:
+        undone.append(history.current)
+        history.back()
+    undone.append(history.current)
+    assert undone == kept[::-1]
+    redone = [history.current]
+    while history.redo:
+        history.forward()
+        redone.append(history.current)
+    assert redone == kept
+    # and once more, so that redo deltas turned back into undo ones work
+    for expected in kept[-2::-1]:
+        history.back()
+        assert history.current == expected
+
+
+def test_push_drops_redo():
+    history = History(depth)
+    pushed = list(checkpoints(3))
+    for checkpoint in pushed[:-1]:
+        history.push(checkpoint)
+    history.back()
+    history.push(pushed[-1])
+    assert not history.redo
+    history.back()
+    assert history.current == pushed[-3]
@@ -0,0 +1,216 @@
+import os
+import pickle
+import time
+import errno
+import shutil
+
+import pytest
+
+from pyctionary import (CardStore, Checkpoint, Deck, Driver, Engine, Game, GameTerminated, History, Journal,
+    ManualClock, State, Team, analyze_save, virtual_curses)
+
+cards_path = os.path.join(os.path.dirname(__file__), os.pardir, 'cards', 'it.csv')
+
+
+def play(path, script, cards_path=cards_path):
+    # a game on a virtual screen, logged to the journal after every key as
+    # the game loop does
+    cards = CardStore(cards_path)
+    with virtual_curses() as screen:
+        engine = Engine(cards.categories, Deck(cards, 1), 3, clock=ManualClock(), seed=1)
+        game = Game(screen, engine, path, autosave_interval=0)
+        game.begin()
+        driver = Driver(engine)
+        for item in script:
+            driver.play([item])
+            if not engine.effects:
+                game.journal_event()
+        game.journal.close()
+    return engine, game.journal.events
+
+
+def test_restore_replays_events(tmp_path):
+    path = str(tmp_path / 'game')
+    # three turns running out of time: guessed, missed and guessed
+    turn = ['\n', '\n', '\n', 65]
+    engine, events = play(path, turn + ['s', 2, '3', 3] + turn + ['f', 2] + turn + ['s', 2, '4', 3, '\n'])
+    assert events > 10
+    assert engine.state == State.watch
+    game = Journal.load(path)
+    for name in ['active_team', 'positions', 'card_data', 'all_play', 'state', 'cell']:
+        assert game[name] == getattr(engine, name)
+    assert (game['deck'].shuffles, game['deck'].pos) == (engine.deck.shuffles, engine.deck.pos)
+    assert game['history'].current == engine.history.current
+    assert list(game['history'].undo) == list(engine.history.undo)
+
+    restored = Engine(game['categories'], game['deck'], 3, clock=ManualClock())
+    restored.load_game(game)
+    assert restored.get_state() == engine.get_state()
+    # undo goes back to the checkpoints of the game played
+    engine.undo()
+    restored.undo()
+    assert restored.get_state() == engine.get_state()
+
+
+def test_restore_ignores_cut_record(tmp_path):
+    path = str(tmp_path / 'game')
+    engine, events = play(path, ['\n', '\n', '\n', 65, 's', 2])
+    with open(path, 'rb') as f:
+        data = f.read()
+    game = Journal.load(path)
+    # a record cut short by a crash is dropped, the previous ones are kept
+    with open(path, 'ab') as f:
+        f.write(data[-20:-10])
+    assert Journal.load(path)['state'] == game['state'] == engine.state
+
+
+def test_analyze_without_card_file(tmp_path):
+    path = str(tmp_path / 'game')
+    cards = str(tmp_path / 'cards.csv')
+    shutil.copy(cards_path, cards)
+    turn = ['\n', '\n', '\n', 65]
+    engine, events = play(path, turn + ['s', 2, '3', 3] + turn + ['f', 2], cards)
+    # the cards are not needed to look back at the game
+    os.remove(cards)
+    result = analyze_save(path)
+    assert 'error' not in result
+    assert [turn['success'] for turn in result['turns']] == [True, False]
+    # the team guessing plays again
+    assert result['turns'][0]['team'] == result['turns'][1]['team']
+    assert result['progress'][-1] == engine.positions
+
+
+def fail(monkeypatch, name, calls):
+    # os.<name> raises ENOSPC on the given calls, counted from 1
+    count = [0]
+    call = getattr(os, name)
+
+    def failing(*args):
+        count[0] += 1
+        if count[0] in calls:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        return call(*args)
+    monkeypatch.setattr(os, name, failing)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_failed_snapshot_waits_for_the_next(tmp_path, monkeypatch):
+    path = str(tmp_path / 'game')
+    fail(monkeypatch, 'replace', [1])
+    journal = Journal(path, 0)
+    journal.snapshot({'state': 1})
+    journal.close()
+    assert journal.error == os.strerror(errno.ENOSPC)
+    # nothing to append the event to
+    journal.event({'state': 2})
+    journal.close()
+    assert not os.path.exists(path)
+    journal.snapshot({'state': 3})
+    journal.event({'state': 4})
+    journal.close()
+    assert journal.error is None
+    assert Journal.load(path) == {'state': 4}
+
+
+def test_failed_event_waits_for_a_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'game')
+    journal = Journal(path, 0)
+    journal.snapshot({'state': 1, 'cell': 'y'})
+    wait_for(lambda: journal.last_save is not None)
+    fail(monkeypatch, 'fsync', [1])
+    journal.event({'state': 2})
+    wait_for(lambda: journal.error)
+    # not appended after a record that may be torn
+    journal.event({'cell': 'b'})
+    journal.close()
+    # the record whose sync failed may have made it, the next one did not
+    assert Journal.load(path)['cell'] == 'y'
+    journal.snapshot({'state': 3, 'cell': 'y'})
+    journal.event({'cell': 'b'})
+    journal.close()
+    assert journal.error is None
+    assert Journal.load(path) == {'state': 3, 'cell': 'b'}
+
+
+def test_game_saves_again_after_a_failure(tmp_path, monkeypatch):
+    path = str(tmp_path / 'game')
+    cards = CardStore(cards_path)
+    fail(monkeypatch, 'replace', [1])
+    with virtual_curses() as screen:
+        engine = Engine(cards.categories, Deck(cards, 1), 2, clock=ManualClock(), seed=1)
+        game = Game(screen, engine, path, autosave_interval=0)
+        game.begin()
+        wait_for(lambda: game.journal.error)
+        driver = Driver(engine)
+        driver.key('\n')
+        game.journal_event()
+        game.journal.close()
+    assert game.journal.error is None
+    assert Journal.load(path)['state'] == engine.state == State.watch
+
+
+def test_quit_reports_failed_save(tmp_path, monkeypatch):
+    path = str(tmp_path / 'game')
+    cards = CardStore(cards_path)
+    fail(monkeypatch, 'replace', range(1, 100))
+    with virtual_curses() as screen:
+        engine = Engine(cards.categories, Deck(cards, 1), 2, clock=ManualClock(), seed=1)
+        game = Game(screen, engine, path, autosave_interval=0)
+        game.begin()
+        with pytest.raises(GameTerminated) as terminated:
+            game.quit(True)
+    assert not terminated.value.saved
+    assert terminated.value.error == os.strerror(errno.ENOSPC)
+
+
+class Payload:
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __reduce__(self):
+        return (os.mkdir, (self.marker,))
+
+
+def test_load_refuses_other_classes(tmp_path):
+    path = str(tmp_path / 'game')
+    marker = str(tmp_path / 'marker')
+    with open(path, 'wb') as f:
+        pickle.dump(('snapshot', {'categories': Payload(marker)}), f)
+    with pytest.raises(pickle.UnpicklingError):
+        Journal.load(path)
+    assert 'UnpicklingError' in analyze_save(path)['error']
+    assert not os.path.exists(marker)
+
+
+def test_load_older_saves(tmp_path):
+    # whole-game pickle, with every checkpoint in full
+    path = str(tmp_path / 'game')
+    states = [[0, [0, 0], [], False, State.pick], [0, [0, 0], [u'a', u'b'], False, State.check],
+        [0, [0, 0], [u'a', u'b'], False, State.roll], [0, [4, 0], [u'a', u'b'], False, State.pick]]
+    with open(path, 'wb') as f:
+        pickle.dump({'categories': [u'oggetto', u'persona'], 'cards': [[u'c', u'd']], 'num_teams': 2,
+            'states': states, 'teams': [Team(0, ('blue', 256)), Team(1, ('magenta', 512))],
+            'active_team': 0, 'positions': [4, 0], 'card_data': [u'a', u'b'], 'time_start': 0,
+            'all_play': False, 'state': State.pick, 'cell': 'R'}, f, pickle.HIGHEST_PROTOCOL)
+    result = analyze_save(path)
+    assert result['teams'] == ['blue', 'magenta']
+    assert [(turn['category'], turn['success']) for turn in result['turns']] == [(u'oggetto', True)]
+    assert result['progress'][-1] == [4, 0]
+
+
+def test_analyze_reports_broken_replay(tmp_path):
+    # loads fine, but its checkpoint names a team that does not exist
+    path = str(tmp_path / 'game')
+    history = History(10)
+    history.push(Checkpoint(5, (0, 0), [u'a', u'b'], False, State.check))
+    journal = Journal(path, 0)
+    journal.snapshot({'categories': [u'oggetto', u'persona'], 'teams': [Team(0, 'blue'), Team(1, 'magenta')],
+        'positions': [0, 0], 'history': history})
+    journal.close()
+    assert 'IndexError' in analyze_save(path)['error']
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from pyctionary import measure_startup
+
+cards_path = os.path.join(os.path.dirname(__file__), os.pardir, 'cards', 'it.csv')
+# seconds to the first frame, the default of bench --startup-budget
+startup_budget = 1
+
+
+def test_first_frame_within_budget():
+    pty = pytest.importorskip('pty')
+    try:
+        for fd in pty.openpty():
+            os.close(fd)
+    except OSError:
+        pytest.skip('no pseudo-terminal available')
+    assert measure_startup(cards_path) < startup_budget